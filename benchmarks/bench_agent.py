@@ -0,0 +1,49 @@
+import json
+import os
+from tldc.context import Context
+from .stubs import OllamaStub, XAIStub
+from .timing import measure
+from .trees import first_line, make_tree
+
+def _script(files: list[str], turns: int, calls: int) -> list:
+    script = []
+    for turn in range(turns):
+        paths = files[turn * calls:(turn + 1) * calls]
+        script.append({"tool_calls": [("read_file", {"path": p}) for p in paths]})
+    first = first_line(files[0])
+    script.append({"tool_calls": [("write_file", {"path": files[0], "search": first, "replace": first})]})
+    script.append({"content": "Done."})
+    return script
+
+def _context(root: str, model: str, provider: str, settings: dict) -> Context:
+    context = Context(root)
+    context.add_model(model, provider, json.dumps(settings))
+    context.set_active_model(model)
+    context = Context(root)
+    context.reset()
+    return context
+
+def run(workdir: str, turns: int, calls: int, repeat: int) -> dict:
+    tree = make_tree(os.path.join(workdir, "agent"), max(turns * calls, 10), large_files=0)
+    script = _script(tree["files"], turns, calls)
+    results = {}
+    with OllamaStub(script) as stub:
+        context = _context(tree["root"], "benchmark-ollama", "ollama", {"url": stub.url})
+        for stream in (False, True):
+            name = f"ollama_prompt{'_stream' if stream else ''}"
+            results[name] = measure(lambda: context.prompt("benchmark", stream), repeat, setup=context.reset)
+        context.start_session()
+        results["ollama_prompt_session"] = measure(lambda: context.prompt("benchmark"), repeat, setup=context.reset)
+        context.db.stop_writer()
+        results["ollama_requests"] = stub.script.requests
+    with XAIStub(script) as stub:
+        context = _context(tree["root"], "benchmark-xai", "xai", {"api_key": "benchmark"})
+        context.assistant.client = stub.client()
+        for stream in (False, True):
+            name = f"xai_prompt{'_stream' if stream else ''}"
+            results[name] = measure(lambda: context.prompt("benchmark", stream), repeat, setup=context.reset)
+        context.start_session()
+        results["xai_prompt_session"] = measure(lambda: context.prompt("benchmark"), repeat, setup=context.reset)
+        context.db.stop_writer()
+        results["xai_requests"] = stub.script.requests
+    return results
@@ -0,0 +1,27 @@
+import json
+from tldc.db import DB
+from .timing import measure
+
+MESSAGE = {"role": "tool", "content": "x" * 2000, "tool_call_id": "call-0"}
+
+def run(sizes: list[int], repeat: int) -> dict:
+    db = DB()
+    results = {}
+    message = json.dumps(MESSAGE)
+    for size in sizes:
+        context = f"/benchmark/history-{size}"
+        db.del_history(context)
+
+        def append():
+            for turn in range(0, size, 4):
+                with db.transaction():
+                    for _ in range(min(4, size - turn)):
+                        db.add_history(context, message)
+
+        results[f"history_append_{size}"] = measure(append, 1)
+        results[f"history_load_{size}"] = measure(lambda: db.get_history(context), repeat)
+        results[f"history_append_one_at_{size}"] = measure(lambda: db.add_history(context, message), repeat)
+        db.del_history(context)
+    results["close"] = measure(lambda: DB().close(), repeat)
+    db.close()
+    return results
@@ -0,0 +1,39 @@
+import os
+import random
+from pathlib import Path
+from tldc.db import DB
+from tldc.dirtree import DirTree
+from .timing import measure
+from .trees import first_line, make_tree
+
+def run(workdir: str, files: int, repeat: int) -> dict:
+    tree = make_tree(os.path.join(workdir, f"tree-{files}"), files, ignored=files // 10)
+    db = DB()
+    dirtree = DirTree(tree["root"], db)
+    rng = random.Random(0)
+    sample = rng.sample(tree["files"], min(len(tree["files"]), 200))
+    deep = max(sample, key=lambda p: p.count("/"))
+    results = {}
+    results["update_index_cold"] = measure(dirtree.update_index, 1)
+    results["update_index_warm"] = measure(dirtree.update_index, repeat)
+    results["list_current_dir"] = measure(dirtree.list_current_dir, repeat)
+    results["list_dir_deep"] = measure(lambda: dirtree.list_dir(os.path.dirname(deep)), repeat)
+    results["list_tree"] = measure(lambda: dirtree.list_tree(".", 64, files * 2, []), repeat)
+    results["check_path"] = measure(lambda: [dirtree.check_path(Path(dirtree.cwd, p)) for p in sample], repeat)
+    results["read_file_cold"] = measure(lambda: [dirtree.read_file(p) for p in sample], repeat,
+                                        setup=lambda: db.del_reads(dirtree.cwd))
+    results["read_file_cached"] = measure(lambda: [dirtree.read_file(p) for p in sample], repeat)
+    results["read_file_large_head"] = measure(lambda: dirtree.read_file(tree["large"][0]), repeat)
+    results["read_file_large_range"] = measure(lambda: dirtree.read_file(tree["large"][0], 100000, 100100), repeat)
+    results["write_file"] = measure(lambda: [_rewrite(dirtree, p) for p in sample[:50]], repeat)
+    results["search_code_literal"] = measure(lambda: dirtree.search_code("function_4242(", False, None, False),
+                                             repeat)
+    results["search_code_regex"] = measure(lambda: dirtree.search_code(r"return value \* 42\d\b", True, None, False),
+                                           repeat)
+    db.close()
+    return results
+
+def _rewrite(dirtree: DirTree, rel: str):
+    first = first_line(rel)
+    assert dirtree.write_file(rel, first, f"{first}  ").startswith("OK")
+    assert dirtree.write_file(rel, f"{first}  ", first).startswith("OK")
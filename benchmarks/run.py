@@ -0,0 +1,62 @@
+import contextlib
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+from importlib import metadata
+import click
+
+def _version():
+    try:
+        return metadata.version("tldc")
+    except metadata.PackageNotFoundError:
+        return "unknown"
+
+def _compare(results: dict, baseline: dict):
+    for suite, metrics in results["results"].items():
+        for name, value in metrics.items():
+            old = baseline.get("results", {}).get(suite, {}).get(name)
+            if isinstance(value, dict) and isinstance(old, dict) and old["median"]:
+                ratio = value["median"] / old["median"]
+                flag = "  <-- slower" if ratio > 1.2 else ""
+                print(f"{suite + '.' + name:<48}{old['median']:>12.6f}{value['median']:>12.6f}{ratio:>8.2f}x{flag}")
+
+@click.command()
+@click.option("--files", default="10000", help="Comma separated tree sizes for the DirTree suite.")
+@click.option("--history", default="1000,10000,100000", help="Comma separated history sizes for the DB suite.")
+@click.option("--turns", default=5, help="Tool call turns per scripted prompt.")
+@click.option("--calls", default=8, help="Tool calls per turn.")
+@click.option("--repeat", default=5)
+@click.option("--suite", "suites", multiple=True, type=click.Choice(["dirtree", "db", "agent"]))
+@click.option("--output", default="bench_output.json")
+@click.option("--compare", "compare_with", default=None, help="Earlier results to compare against.")
+def main(files, history, turns, calls, repeat, suites, output, compare_with):
+    suites = suites or ("dirtree", "db", "agent")
+    workdir = tempfile.mkdtemp(prefix="tldc-bench-")
+    os.environ["HOME"] = workdir
+    from . import bench_agent, bench_db, bench_dirtree
+    results = {"version": _version(), "python": sys.version.split()[0], "platform": platform.platform(),
+               "timestamp": time.time(), "results": {}}
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        if "dirtree" in suites:
+            for size in map(int, files.split(",")):
+                results["results"][f"dirtree_{size}"] = bench_dirtree.run(workdir, size, repeat)
+        if "db" in suites:
+            results["results"]["db"] = bench_db.run([int(s) for s in history.split(",")], repeat)
+        if "agent" in suites:
+            results["results"]["agent"] = bench_agent.run(workdir, turns, calls, repeat)
+    with open(output, "w") as file:
+        json.dump(results, file, indent=2)
+    for suite, metrics in results["results"].items():
+        for name, value in metrics.items():
+            if isinstance(value, dict):
+                print(f"{suite + '.' + name:<48}{value['median']:>12.6f}s")
+    if compare_with:
+        with open(compare_with) as file:
+            _compare(results, json.load(file))
+    print(f"Results written to {output}")
+
+if __name__ == "__main__":
+    main()
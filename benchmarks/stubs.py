@@ -0,0 +1,122 @@
+import json
+import socket
+import threading
+from concurrent import futures
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import grpc
+from xai_sdk.proto import chat_pb2, chat_pb2_grpc, usage_pb2
+
+# A script is a list of turns, each either {"tool_calls": [(name, args), ...]} or {"content": "..."}.
+# Both stubs replay it in order and wrap around, so one script serves many prompts.
+
+class _Script:
+    def __init__(self, script):
+        self.script = script
+        self.index = 0
+        self.requests = 0
+        self.lock = threading.Lock()
+
+    def next(self):
+        with self.lock:
+            turn = self.script[self.index % len(self.script)]
+            self.index += 1
+            self.requests += 1
+            return self.index, turn
+
+class OllamaStub:
+    def __init__(self, script):
+        self.script = _Script(script)
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def setup(self):
+                super().setup()
+                self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+            def log_message(self, *args):
+                pass
+
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+                data = stub.respond(body)
+                self.send_response(200)
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.server.server_port}"
+
+    def respond(self, body):
+        index, turn = self.script.next()
+        message = {"role": "assistant", "content": turn.get("content", "")}
+        if turn.get("tool_calls"):
+            message["tool_calls"] = [{"id": f"call-{index}-{i}", "function": {"name": name, "arguments": args}}
+                                     for i, (name, args) in enumerate(turn["tool_calls"])]
+        data = {"message": message, "done": True, "prompt_eval_count": 100, "eval_count": 10}
+        if body.get("stream"):
+            return (json.dumps({"message": message, "done": False}) + "\n" +
+                    json.dumps({**data, "message": {"role": "assistant", "content": ""}}) + "\n").encode()
+        return json.dumps(data).encode()
+
+    def __enter__(self):
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *args):
+        self.server.shutdown()
+        self.server.server_close()
+
+class _ChatServicer(chat_pb2_grpc.ChatServicer):
+    def __init__(self, script):
+        self.script = script
+
+    def _message(self, index, turn):
+        tool_calls = [chat_pb2.ToolCall(id=f"call-{index}-{i}",
+                                        function=chat_pb2.FunctionCall(name=name, arguments=json.dumps(args)))
+                      for i, (name, args) in enumerate(turn.get("tool_calls", []))]
+        return turn.get("content", ""), tool_calls
+
+    def GetCompletion(self, request, context):
+        index, turn = self.script.next()
+        content, tool_calls = self._message(index, turn)
+        return chat_pb2.GetChatCompletionResponse(
+            id=f"resp-{index}",
+            choices=[chat_pb2.Choice(index=0, message=chat_pb2.CompletionMessage(
+                content=content, role=chat_pb2.ROLE_ASSISTANT, tool_calls=tool_calls))],
+            usage=usage_pb2.SamplingUsage(prompt_tokens=100, completion_tokens=10, total_tokens=110))
+
+    def GetCompletionChunk(self, request, context):
+        index, turn = self.script.next()
+        content, tool_calls = self._message(index, turn)
+        yield chat_pb2.GetChatCompletionChunk(
+            id=f"resp-{index}",
+            choices=[chat_pb2.ChoiceChunk(index=0, delta=chat_pb2.Delta(
+                content=content, role=chat_pb2.ROLE_ASSISTANT, tool_calls=tool_calls))],
+            usage=usage_pb2.SamplingUsage(prompt_tokens=100, completion_tokens=10, total_tokens=110))
+
+class XAIStub:
+    def __init__(self, script):
+        self.script = _Script(script)
+        self.server = grpc.server(futures.ThreadPoolExecutor(max_workers=4))
+        chat_pb2_grpc.add_ChatServicer_to_server(_ChatServicer(self.script), self.server)
+        self.port = self.server.add_insecure_port("127.0.0.1:0")
+
+    def client(self):
+        from xai_sdk.sync.chat import Client as ChatClient
+
+        class Client:
+            pass
+
+        client = Client()
+        client.chat = ChatClient(grpc.insecure_channel(f"127.0.0.1:{self.port}"))
+        return client
+
+    def __enter__(self):
+        self.server.start()
+        return self
+
+    def __exit__(self, *args):
+        self.server.stop(None)
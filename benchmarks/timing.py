@@ -0,0 +1,12 @@
+import statistics
+import time
+
+def measure(fn, repeat: int = 5, setup=None) -> dict:
+    times = []
+    for _ in range(repeat):
+        if setup:
+            setup()
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    return {"min": min(times), "median": statistics.median(times), "max": max(times), "repeat": repeat}
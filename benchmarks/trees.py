@@ -0,0 +1,47 @@
+import os
+import random
+
+LINE = "def function_{n}(value):\n    return value * {n}  # synthetic line {n}\n"
+
+def first_line(rel: str) -> str:
+    return LINE.format(n=os.path.basename(rel)[1:-3]).split("\n", 1)[0]
+
+def _text(lines: int, seed: int) -> str:
+    return "".join(LINE.format(n=seed + i) for i in range(lines))
+
+def make_tree(root: str, files: int, depth: int = 6, fanout: int = 8, large_files: int = 2,
+              large_size: int = 32 * 1024 * 1024, ignored: int = 0, seed: int = 0) -> dict:
+    rng = random.Random(seed)
+    os.makedirs(root, exist_ok=True)
+    paths = []
+    for i in range(files):
+        parts = []
+        n = i
+        for _ in range(rng.randint(1, depth)):
+            parts.append(f"d{n % fanout}")
+            n //= fanout
+        rel = os.path.join(*parts, f"f{i}.py")
+        fullp = os.path.join(root, rel)
+        os.makedirs(os.path.dirname(fullp), exist_ok=True)
+        with open(fullp, "w") as file:
+            file.write(_text(rng.randint(5, 200), i))
+        paths.append(rel)
+    large = []
+    for i in range(large_files):
+        rel = f"large{i}.log"
+        with open(os.path.join(root, rel), "w") as file:
+            chunk = _text(1000, i)
+            written = 0
+            while written < large_size:
+                file.write(chunk)
+                written += len(chunk)
+        large.append(rel)
+    if ignored:
+        with open(os.path.join(root, ".gitignore"), "w") as file:
+            file.write("node_modules/\n*.tmp\n")
+        for i in range(ignored):
+            fullp = os.path.join(root, "node_modules", f"pkg{i % 100}", f"index{i}.js")
+            os.makedirs(os.path.dirname(fullp), exist_ok=True)
+            with open(fullp, "w") as file:
+                file.write("module.exports = {};\n")
+    return {"root": root, "files": paths, "large": large}
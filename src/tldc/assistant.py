@@ -1,95 +1,410 @@
 from __future__ import annotations
+import contextvars
+import hashlib
+import json
+import os
+import time
+from abc import ABC, abstractmethod
+from importlib import import_module
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+from functools import cached_property
 from typing import Type
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, Field, ValidationError
 from xai_sdk.chat import tool
+from .compact import compact_messages, estimate_messages, estimate_tokens
+from .constants import TOOL_WORKERS, COMPACT_TOKEN_BUDGET, COMPACT_KEEP_TURNS
+from .constants import DIRTREE_TREE_MAX_DEPTH, DIRTREE_TREE_MAX_ENTRIES
+from .constants import MODEL_RETRIES, MODEL_BACKOFF, REPLAY_ENV
+from .constants import HEDGE_PERCENTILE, HEDGE_SAMPLES, HEDGE_MIN_SAMPLES, HEDGE_MIN_DELAY, HEDGE_DEFAULT_DELAY
 from .db import DB
 from .dirtree import DirTree
+from .encode import encode_result
+from .hedge import race
+from .logger import logger
+from .telemetry import Telemetry, percentile
 
-_registry: dict[str, Type['Assistant']] = {}
+_registry: dict[str, Type['Assistant'] | str] = {
+    "xai": ".providers.xai:XAI",
+    "ollama": ".providers.ollama:Ollama",
+}
 
 class ReadFileRequest(BaseModel):
     path: str = Field(description="Path to the file, relative to the working directory.")
+    start_line: int | None = Field(default=None, description="First line to return, 1-based. Use it with end_line to read a part of a large file.")
+    end_line: int | None = Field(default=None, description="Last line to return, inclusive.")
+    offset: int | None = Field(default=None, ge=0, description="Byte offset to start reading from, instead of a line range.")
+    length: int | None = Field(default=None, gt=0, description="Number of bytes to read from offset.")
+    line_numbers: bool = Field(default=False, description="Prefix each returned line with its line number and a tab. The numbers are not part of the file, never include them in write_file search or replace.")
 
 class WriteFileRequest(BaseModel):
     path: str = Field(description="Path to the file, relative to the working directory.")
-    search: str = Field(description="Part of the file to replace. Exactly as it appears in the file, no extra escape codes. When only adding new code, search for surrounding lines and include them in the replacement. There should be only one match. If empty, entire file will be rewritten.")
+    search: str = Field(description="Part of the file to replace. Exactly as it appears in the file, no extra escape codes. Whole lines that differ only in whitespace or indentation still match. When only adding new code, search for surrounding lines and include them in the replacement. There should be only one match. If empty, entire file will be rewritten.")
     replace: str = Field(description="Text to replace search with. Perfectly formatted, with correct indentation, as it's supposed to look like in the file.")
 
+class ReadFilesRequest(BaseModel):
+    paths: list[str] = Field(description="Paths to the files, relative to the working directory.")
+
+class FileEdit(WriteFileRequest):
+    pass
+
+class WriteFilesRequest(BaseModel):
+    edits: list[FileEdit] = Field(description="Search/replace edits to apply, in order. Several edits may target the same file. Either all edits are applied or none of them.")
+
+class SearchCodeRequest(BaseModel):
+    query: str = Field(description="Text or regular expression to search for.")
+    regex: bool = Field(default=False, description="Treat query as a Python regular expression.")
+    glob: str | None = Field(default=None, description="Only search files matching this glob pattern, e.g. '*.py' or 'src/*'.")
+    ignore_case: bool = Field(default=False, description="Match case-insensitively.")
+
 class ListCurrentDirRequest(BaseModel):
     pass
 
 class ListDirRequest(BaseModel):
     path: str = Field(description="Relative path to the directory whose contents to list.")
 
-class Assistant:
+class ListTreeRequest(BaseModel):
+    path: str = Field(default=".", description="Relative path to the directory to list recursively.")
+    max_depth: int = Field(default=DIRTREE_TREE_MAX_DEPTH, description="How many directory levels to descend.")
+    max_entries: int = Field(default=DIRTREE_TREE_MAX_ENTRIES, description="Maximum number of entries to return.")
+    globs: list[str] = Field(default=[], description="Only list files matching any of these glob patterns, e.g. '*.py'.")
+
+class Assistant(ABC):
     def __init__(self, model, provider, settings, db: DB, dirtree: DirTree):
         self.model = model
         self.provider = provider
+        self.settings = json.loads(settings)
+        self.compact_budget = self.settings.get("compact_budget", COMPACT_TOKEN_BUDGET)
         self.db = db
         self.dirtree = dirtree
+        self.telemetry = Telemetry(db, dirtree.cwd, model)
+        self.interactive = False
+        self.messages = []
+        self.response_id = None
+        self.deadline = None
 
     tool_definitions = [
         tool(
             name="read_file",
-            description="Returns file contents from given path or an error message.",
+            description="Returns file contents from given path or an error message. Large files are returned partially, with a header giving the returned line range and the total number of lines.",
             parameters=ReadFileRequest.model_json_schema(),
         ),
         tool(
             name="write_file",
-            description="Writes file contents to given path. Returns OK or an error message.",
+            description="Writes file contents to given path. Returns OK with the replaced line range, or an error message.",
             parameters=WriteFileRequest.model_json_schema(),
         ),
+        tool(
+            name="read_files",
+            description="Returns the contents of each of the given files, or an error message, after a '==> path <==' header line. Use it instead of several read_file calls.",
+            parameters=ReadFilesRequest.model_json_schema(),
+        ),
+        tool(
+            name="write_files",
+            description="Applies several search/replace edits across one or more files at once. All edits are validated first and written only if every one of them matches. Returns one line per edit, numbered from 1, with OK and the replaced line range, or an error message.",
+            parameters=WriteFilesRequest.model_json_schema(),
+        ),
+        tool(
+            name="search_code",
+            description="Searches all project files for a text or regular expression and returns matching lines as 'path:line: text', best matching files first. Use it to find code instead of reading many files.",
+            parameters=SearchCodeRequest.model_json_schema(),
+        ),
         tool(
             name="list_current_dir",
-            description="Returns json list of direct child entries (files and directories) in the current working directory. Paths are relative to cwd (basenames). Each entry has 'path' and 'is_dir' (boolean).",
+            description="Returns direct child entries (files and directories) of the current working directory, one path per line, relative to cwd. Directories end with '/'.",
             parameters=ListCurrentDirRequest.model_json_schema(),
         ),
         tool(
             name="list_dir",
-            description="Returns json list of direct child entries (files and directories) in the given relative directory path. Paths are relative to cwd. Each entry has 'path' and 'is_dir' (boolean).",
+            description="Returns direct child entries (files and directories) of the given relative directory path, one path per line, relative to cwd. Directories end with '/'.",
             parameters=ListDirRequest.model_json_schema(),
         ),
+        tool(
+            name="list_tree",
+            description="Returns a recursive listing of the given directory as indented text, one entry per line, directories end with '/'. Use it to explore the project in one call instead of many list_dir calls.",
+            parameters=ListTreeRequest.model_json_schema(),
+        ),
     ]
 
     request_classes = {
         "read_file": ReadFileRequest,
         "write_file": WriteFileRequest,
+        "read_files": ReadFilesRequest,
+        "write_files": WriteFilesRequest,
+        "search_code": SearchCodeRequest,
         "list_current_dir": ListCurrentDirRequest,
         "list_dir": ListDirRequest,
+        "list_tree": ListTreeRequest,
     }
 
     def read_file(self, request: ReadFileRequest):
-        return self.dirtree.read_file(request.path)
+        return self.dirtree.read_file(request.path, request.start_line, request.end_line, request.offset,
+                                      request.length, request.line_numbers)
 
     def write_file(self, request: WriteFileRequest):
         return self.dirtree.write_file(request.path, request.search, request.replace)
 
+    def read_files(self, request: ReadFilesRequest):
+        return self.dirtree.read_files(request.paths)
+
+    def write_files(self, request: WriteFilesRequest):
+        return self.dirtree.write_files([(e.path, e.search, e.replace) for e in request.edits])
+
+    def search_code(self, request: SearchCodeRequest):
+        return self.dirtree.search_code(request.query, request.regex, request.glob, request.ignore_case)
+
     def list_current_dir(self, request: ListCurrentDirRequest):
         return self.dirtree.list_current_dir()
 
     def list_dir(self, request: ListDirRequest):
         return self.dirtree.list_dir(request.path)
 
+    def list_tree(self, request: ListTreeRequest):
+        return self.dirtree.list_tree(request.path, request.max_depth, request.max_entries, request.globs)
+
     tools_map = {
         "read_file": read_file,
         "write_file": write_file,
+        "read_files": read_files,
+        "write_files": write_files,
+        "search_code": search_code,
         "list_current_dir": list_current_dir,
         "list_dir": list_dir,
+        "list_tree": list_tree,
     }
 
-    def prompt(self, prompt):
+    read_only_tools = {"read_file", "read_files", "search_code", "list_current_dir", "list_dir", "list_tree"}
+    listing_tools = {"search_code", "list_current_dir", "list_dir", "list_tree"}
+
+    def _tool_paths(self, function_name, request):
+        if function_name in self.listing_tools:
+            return None
+        if hasattr(request, "paths"):
+            paths = request.paths
+        elif hasattr(request, "edits"):
+            paths = [edit.path for edit in request.edits]
+        elif hasattr(request, "path"):
+            paths = [request.path]
+        else:
+            return None
+        return {os.path.normpath(p) for p in paths}
+
+    def _run_tool(self, deps, function_name, request):
+        wait(deps)
+        with self.telemetry.span("tool", function_name) as record:
+            result = self.tools_map[function_name](self, request)
+            encoded = encode_result(function_name, result)
+            as_json = json.dumps(result)
+            record["bytes_in"] = len(request.model_dump_json())
+            record["bytes_out"] = len(encoded)
+            record["meta"].update(json_bytes=len(as_json), tokens=estimate_tokens(encoded),
+                                  json_tokens=estimate_tokens(as_json))
+        return encoded
+
+    def _tool_request(self, function_name, function_args):
+        try:
+            return self.request_classes[function_name](**function_args)
+        except ValidationError as e:
+            errors = "; ".join(f"{'.'.join(map(str, err['loc']))}: {err['msg']}" for err in e.errors())
+            logger(f"AI called {function_name} with invalid arguments, {errors}", "warn")
+            return f"Trying to call {function_name}: invalid arguments, {errors}"
+
+    def _run_tools(self, calls):
+        futures = []
+        writes = []
+        touched = []
+        with ThreadPoolExecutor(max_workers=TOOL_WORKERS) as executor:
+            for function_name, request in calls:
+                if isinstance(request, str):
+                    future = Future()
+                    future.set_result(request)
+                    futures.append(future)
+                    continue
+                paths = self._tool_paths(function_name, request)
+                read_only = function_name in self.read_only_tools
+                if read_only:
+                    deps = [f for p, f in writes if paths is None or p is None or p in paths]
+                elif paths is None:
+                    deps = futures[:]
+                else:
+                    deps = [f for p, f in touched if p is None or p in paths]
+                future = executor.submit(contextvars.copy_context().run, self._run_tool, deps, function_name,
+                                         request)
+                futures.append(future)
+                for p in paths or [None]:
+                    touched.append((p, future))
+                    if not read_only:
+                        writes.append((p, future))
+        return [f.result() for f in futures]
+
+    @cached_property
+    def hedge(self):
+        config = self.settings.get("hedge")
+        if not config:
+            return None
+        model = self.db.get_model(config["model"])
+        if model is None or model["provider"] != self.provider:
+            logger(f"Hedge model {config['model']} must be a configured {self.provider} model, not hedging", "warn")
+            return None
+        return Assistant.create(model["model_name"], model["provider"], model["settings"], self.db, self.dirtree)
+
+    def _hedge_delay(self):
+        config = self.settings["hedge"]
+        if "delay" in config:
+            return config["delay"]
+        durations = self.db.get_durations("model", self.model, HEDGE_SAMPLES)
+        if len(durations) < HEDGE_MIN_SAMPLES:
+            return HEDGE_DEFAULT_DELAY
+        return max(percentile(durations, config.get("percentile", HEDGE_PERCENTILE)),
+                   config.get("min_delay", HEDGE_MIN_DELAY))
+
+    def _transient(self, e):
+        return False
+
+    def _cached(self, request: bytes, call, encode, decode):
+        mode = os.environ.get(REPLAY_ENV)
+        if mode not in ("record", "replay", "dedupe"):
+            return call(), None
+        key = hashlib.sha256(self.model.encode() + b"\0" + request).hexdigest()
+        if mode != "record":
+            row = self.db.get_response(key)
+            if row:
+                return decode(row["response"]), row["response"]
+            if mode == "replay":
+                raise LookupError(f"No recorded response for {self.model} request {key[:16]}")
+        result = call()
+        response = encode(result)
+        self.db.defer(lambda db: db.set_response(key, self.model, request, response))
+        return result, None
+
+    def _call_model(self, attempt, record, stream=False):
+        retries = self.settings.get("model_retries", MODEL_RETRIES)
+        for n in range(retries + 1):
+            try:
+                if stream or self.hedge is None:
+                    return attempt(self)
+                self.hedge.deadline = self.deadline
+                index, result, started = race([lambda: attempt(self), lambda: attempt(self.hedge)], self._hedge_delay())
+                if started > 1:
+                    record["meta"].update(hedged=True, winner=self.hedge.model if index else self.model)
+                return result
+            except Exception as e:
+                if n == retries or not self._transient(e):
+                    raise
+                delay = self.settings.get("model_backoff", MODEL_BACKOFF) * 2 ** n
+                record["meta"]["retries"] = n + 1
+                logger(f"{self.model} failed with {repr(e)}, retrying in {delay:.1f}s", "warn")
+                time.sleep(delay)
+
+    @abstractmethod
+    def prompt(self, prompt, stream=False):
         pass
 
+    def start_session(self, writer=None):
+        self.messages = self.get_messages()
+        self.response_id = self.get_response_id()
+        self.interactive = True
+        self.db.start_writer(writer)
+
+    def _remaining(self):
+        if self.deadline is None:
+            return None
+        remaining = self.deadline - time.monotonic()
+        if remaining <= 0:
+            raise TimeoutError("Deadline exceeded")
+        return remaining
+
+    def get_messages(self):
+        if self.interactive:
+            return self.messages[:]
+        return [json.loads(message) for message in self.db.get_history(self.dirtree.cwd)]
+
+    def has_history(self):
+        return bool(self.messages) if self.interactive else self.db.has_history(self.dirtree.cwd)
+
+    def get_response_id(self):
+        return self.response_id if self.interactive else self.db.get_response_id(self.dirtree.cwd)
+
+    def save_turn(self, messages, response_id=None):
+        context = self.dirtree.cwd
+        rows = [json.dumps(m) for m in messages]
+        if self.interactive:
+            self.messages.extend(messages)
+            self.response_id = response_id or self.response_id
+
+        def write(db):
+            with db.transaction():
+                if response_id:
+                    db.set_response_id(context, response_id)
+                for row in rows:
+                    db.add_history(context, row)
+        with self.telemetry.span("db", "turn"):
+            self.db.defer(write)
+
+    @abstractmethod
+    def _summarize(self, messages):
+        pass
+
+    def compact(self, force=False, tokens=None):
+        messages = self.get_messages()
+        before = estimate_messages(messages) if tokens is None else tokens
+        if not force and before <= self.compact_budget:
+            return None
+        compacted = compact_messages(messages, self.compact_budget, COMPACT_KEEP_TURNS, self._summarize, force, tokens)
+        if compacted == messages:
+            return None
+        context = self.dirtree.cwd
+        rows = [json.dumps(m) for m in compacted]
+        if self.interactive:
+            self.messages = compacted
+            self.response_id = None
+
+        def write(db):
+            with db.transaction():
+                db.set_history(context, rows)
+                db.reset_response_id(context)
+        with self.telemetry.span("db", "compact"):
+            self.db.del_reads(context)
+            self.db.defer(write)
+        after = estimate_messages(compacted)
+        logger(f"Compacted context from ~{before} to ~{after} tokens")
+        return before, after
+
+    def prune(self, max_age, max_bytes):
+        context = self.dirtree.cwd
+        if not self.interactive:
+            self.db.defer(lambda db: db.prune_history(context, max_age, max_bytes))
+            return
+        # Prune after the deferred turns land, then reload so the session doesn't resend or rewrite what's gone
+        self.db.flush()
+        if self.db.prune_history(context, max_age, max_bytes):
+            self.messages = [json.loads(message) for message in self.db.get_history(context)]
+            self.response_id = self.db.get_response_id(context)
+
+    def save_settings(self):
+        self.db.add_model(self.model, self.provider, json.dumps(self.settings))
+
     def reset(self):
-        self.db.reset_response_id(self.dirtree.cwd)
-        self.db.del_history(self.dirtree.cwd)
+        context = self.dirtree.cwd
+        self.messages = []
+        self.response_id = None
+
+        def write(db):
+            with db.transaction():
+                db.reset_response_id(context)
+                db.del_history(context)
+        self.db.del_reads(context)
+        self.db.defer(write)
 
     @classmethod
     def create(cls, model, provider, settings, db: DB, dirtree: DirTree) -> 'Assistant':
-        sub_cls: Type['Assistant'] = _registry.get(provider)
+        sub_cls: Type['Assistant'] | str = _registry.get(provider)
         if sub_cls is None:
             raise ValueError(f"Provider not implemented: {provider}")
+        if isinstance(sub_cls, str):
+            module_name, _, class_name = sub_cls.partition(":")
+            sub_cls = getattr(import_module(module_name, __package__), class_name)
+            _registry[provider] = sub_cls
         return sub_cls(model, provider, settings, db, dirtree)
 
-def register(provider, cls: Type['Assistant']):
+def register(provider, cls: Type['Assistant'] | str):
     _registry[provider] = cls
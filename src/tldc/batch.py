@@ -0,0 +1,84 @@
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from .constants import BATCH_MODEL_CONCURRENCY
+from .context import Context
+from .db import Writer
+
+def load_manifest(file):
+    jobs = []
+    for line in file:
+        if line.strip():
+            job = json.loads(line)
+            job["cwd"] = os.path.abspath(os.path.expanduser(job["cwd"]))
+            jobs.append(job)
+    return jobs
+
+class Batch:
+    def __init__(self, context: Context, workers, timeout=None, model_concurrency=None):
+        self.context = context
+        self.workers = workers
+        self.timeout = timeout
+        self.model_concurrency = model_concurrency
+        self.limits = {}
+        self.locks = {}
+
+    def _limit(self, model_name):
+        if model_name not in self.limits:
+            model = self.context.db.get_model(model_name)
+            settings = json.loads(model["settings"]) if model else {}
+            self.limits[model_name] = threading.BoundedSemaphore(
+                self.model_concurrency or settings.get("concurrency", BATCH_MODEL_CONCURRENCY))
+        return self.limits[model_name]
+
+    def _run_job(self, index, job, writer):
+        result = {"index": index, "cwd": job["cwd"], "model": job["model"], "status": "ok"}
+        queued = time.perf_counter()
+        with self.locks[job["cwd"]], self._limit(job["model"]):
+            started = time.perf_counter()
+            result["started"] = time.time()
+            result["queued"] = started - queued
+            timeout = job.get("timeout", self.timeout)
+            deadline = time.monotonic() + timeout if timeout else None
+            context = None
+            try:
+                context = Context(job["cwd"], model_name=job["model"])
+                context.assistant.deadline = deadline
+                context.start_session(writer)
+                result["response"] = context.run_prompt(job["prompt"])
+            except (Exception, SystemExit) as e:
+                timed_out = isinstance(e, TimeoutError) or (deadline is not None and time.monotonic() >= deadline)
+                result["status"] = "timeout" if timed_out else "error"
+                result["error"] = repr(e)
+            finally:
+                if context is not None:
+                    context.db.close(maintain=False)
+                result["duration"] = time.perf_counter() - started
+        return result
+
+    def run(self, jobs, output):
+        active_model = self.context.get_active_model()
+        for job in jobs:
+            job.setdefault("model", active_model)
+            self.locks.setdefault(job["cwd"], threading.Lock())
+            self._limit(job["model"])
+        writer = Writer()
+        writer.start()
+        results = []
+        try:
+            with ThreadPoolExecutor(max_workers=self.workers) as executor:
+                futures = [executor.submit(self._run_job, i, job, writer) for i, job in enumerate(jobs)]
+                try:
+                    for future in as_completed(futures):
+                        result = future.result()
+                        results.append(result)
+                        output.write(json.dumps(result) + "\n")
+                        output.flush()
+                except KeyboardInterrupt:
+                    executor.shutdown(wait=False, cancel_futures=True)
+                    raise
+        finally:
+            writer.stop()
+        return results
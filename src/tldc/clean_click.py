@@ -17,7 +17,7 @@ def get_params_usage(cmd, ctx):
             if p.is_flag:
                 opts.append(f"{opt_str}")
             else:
-                dest = p.dest.upper()
+                dest = p.metavar or p.name.upper()
                 opts.append(f"{opt_str} {dest}")
     param_str = " ".join(args)
     if opts:
@@ -0,0 +1,72 @@
+import json
+from .constants import COMPACT_CHARS_PER_TOKEN
+
+SUMMARY_PREFIX = "Summary of the conversation so far:\n"
+
+def estimate_tokens(text: str) -> int:
+    return (len(text) + COMPACT_CHARS_PER_TOKEN - 1) // COMPACT_CHARS_PER_TOKEN
+
+def estimate_messages(messages) -> int:
+    return sum(estimate_tokens(json.dumps(m)) for m in messages)
+
+def is_summary(message) -> bool:
+    return message.get("role") == "system" and message.get("content", "").startswith(SUMMARY_PREFIX)
+
+def split_turns(messages, keep_turns):
+    start = 0
+    while start < len(messages) and messages[start].get("role") == "system" and not is_summary(messages[start]):
+        start += 1
+    users = [i for i in range(start, len(messages)) if messages[i].get("role") == "user"]
+    cut = users[-keep_turns] if len(users) >= keep_turns else start
+    return messages[:start], messages[start:cut], messages[cut:]
+
+def _stub(function_name, args, content):
+    try:
+        result = json.loads(content)
+    except ValueError:
+        result = content
+    if isinstance(result, list):
+        size = f"{len(result)} entries"
+    else:
+        size = f"{len(str(result).splitlines())} lines"
+    if function_name == "read_file":
+        return f"[compacted] read {args.get('path')}, {size}"
+    if args.get("path"):
+        return f"[compacted] {function_name} {args['path']}, {size}"
+    return f"[compacted] {function_name}, {size}"
+
+def stub_tool_results(messages):
+    result = []
+    pending = []
+    for message in messages:
+        if message.get("role") == "assistant" and message.get("tool_calls"):
+            pending = list(message["tool_calls"])
+        elif message.get("role") == "tool" and pending:
+            function = pending.pop(0).get("function", {})
+            args = function.get("arguments", {})
+            if isinstance(args, str):
+                args = json.loads(args)
+            stub = _stub(function.get("name"), args, message.get("content", ""))
+            if len(stub) < len(message.get("content", "")):
+                message = {**message, "content": stub}
+        result.append(message)
+    return result
+
+def transcript(messages) -> str:
+    lines = []
+    for message in messages:
+        if message.get("content"):
+            lines.append(f"{message['role']}: {message['content']}")
+        for tool_call in message.get("tool_calls", []):
+            function = tool_call.get("function", {})
+            lines.append(f"{message['role']}: called {function.get('name')} {json.dumps(function.get('arguments'))}")
+    return "\n".join(lines)
+
+def compact_messages(messages, budget, keep_turns, summarize, force=False, tokens=None):
+    head, old, recent = split_turns(messages, keep_turns)
+    old = stub_tool_results(old)
+    if tokens is None:
+        tokens = estimate_messages(head + old + recent)
+    if old and (force or tokens > budget):
+        old = [{"role": "system", "content": SUMMARY_PREFIX + summarize(old)}]
+    return head + old + recent
@@ -3,5 +3,89 @@ APP_FULLNAME = "too lazy; didn't code"
 DEFAULT_OLLAMA_MODEL = "llama3.2:3b"
 DEFAULT_OLLAMA_SETTINGS = '{"url": "http://127.0.0.1:11434"}'
 SYSTEM_PROMPT = "You are an experienced programmer. You excel at solving problems. Don't add superfluous comments or escape codes to the code. Utilize the available tools to fulfill prompt's requirements. If write_file tool returns an error, immediately reread the file and try writing changes again. Provide relatively short summary. Always, with every prompt, refer to DEVNOTES.md file if it exists for information about steps that were taken earlier, and always update it at the end (create it if it's missing)."
-DIRTREE_EXCLUDE = [".git", ".idea", ".python-version", ".venv", "venv", "dist"]
-DIRTREE_EXCLUDE_ANYWHERE = ["__pycache__"]
\ No newline at end of file
+DIRTREE_IGNORE = [".git", "/.idea/", "/.python-version", "/.venv/", "/venv/", "/dist/", "__pycache__/"]
+DIRTREE_HASH_CHUNK_SIZE = 1024 * 1024
+TOOL_WORKERS = 8
+DB_BUSY_TIMEOUT = 30.0
+DB_VACUUM_FREELIST_RATIO = 0.25
+DB_VACUUM_MIN_PAGES = 1024
+OLLAMA_TIMEOUT = 600
+OLLAMA_RETRIES = 3
+OLLAMA_BACKOFF = 0.5
+OLLAMA_POOL_SIZE = 4
+COMPACT_TOKEN_BUDGET = 65536
+COMPACT_KEEP_TURNS = 2
+COMPACT_CHARS_PER_TOKEN = 4
+COMPACT_PROMPT = "Summarize the conversation so far for your own future reference. Keep the user's goals, decisions that were made, files that were read or changed and what is left to do. Be concise, don't call any tools."
+READ_CACHE_MAX_BYTES = 8 * 1024 * 1024
+READ_CACHE_DIFF = True
+DIRTREE_READ_MAX_BYTES = 256 * 1024
+DIRTREE_BINARY_CHECK_BYTES = 8192
+BINARY_SIGNATURES = {
+    b"\x7fELF": "ELF executable",
+    b"\x89PNG": "PNG image",
+    b"\xff\xd8\xff": "JPEG image",
+    b"GIF8": "GIF image",
+    b"%PDF": "PDF document",
+    b"PK\x03\x04": "zip archive",
+    b"\x1f\x8b": "gzip archive",
+    b"SQLite format 3": "SQLite database",
+}
+DIRTREE_TREE_MAX_DEPTH = 4
+DIRTREE_TREE_MAX_ENTRIES = 2000
+SEARCH_MAX_FILE_BYTES = 1024 * 1024
+SEARCH_MAX_FILES = 200
+SEARCH_MAX_RESULTS = 100
+SEARCH_MAX_LINE = 200
+TRACE_ENV = "TLDC_TRACE"
+REPLAY_ENV = "TLDC_REPLAY"
+STATS_SLOWEST = 10
+DAEMON_SOCKET = "tldc.sock"
+DAEMON_LOCAL_COMMANDS = {"daemon", "chat", "batch"}
+CHAT_HISTORY_FILE = "chat_history"
+CHAT_HISTORY_LENGTH = 1000
+CHANGES_MAX_PATHS = 50
+CHANGES_MAX_FILE_DIFF = 4096
+CHANGES_MAX_BYTES = 16384
+BATCH_WORKERS = 8
+BATCH_MODEL_CONCURRENCY = 4
+MODEL_RETRIES = 2
+MODEL_BACKOFF = 1.0
+HEDGE_PERCENTILE = 95
+HEDGE_SAMPLES = 200
+HEDGE_MIN_SAMPLES = 20
+HEDGE_MIN_DELAY = 1.0
+HEDGE_DEFAULT_DELAY = 10.0
+MANIFEST_FILES = ["DEVNOTES.md", "README.md", "pyproject.toml", "setup.py", "setup.cfg", "requirements.txt",
+                  "package.json", "Cargo.toml", "go.mod", "Makefile", "CMakeLists.txt", "pom.xml", "build.gradle"]
+MANIFEST_MAX_DEPTH = 3
+MANIFEST_MAX_ENTRIES = 200
+MANIFEST_FILE_MAX_BYTES = 16384
+MANIFEST_MAX_BYTES = 32768
+HISTORY_COMPRESS_LEVEL = 6
+HISTORY_ZDICTS = [(b'"type": "function", "function": {"name": "list_dir", "arguments": {"path": "'
+                   b'"read_files", "arguments": {"paths": ["'
+                   b'"write_files", "arguments": {"files": [{"path": "", "search": "", "replace": "'
+                   b'"search_code", "arguments": {"literal": "'
+                   b'"list_current_dir", "arguments": {}}}]}'
+                   b'\\n    def __init__(self, return None if else import from class \\n\\n'
+                   b'"thinking": "", "images": null, "tool_name": "'
+                   b'{"role": "tool", "content": "==> '
+                   b'{"role": "assistant", "content": "", "tool_calls": [{"id": "call_'
+                   b'{"role": "user", "content": "'),
+                  (b'"type": "function", "function": {"name": "list_dir", "arguments": {"path": "'
+                   b'"read_files", "arguments": {"paths": ["'
+                   b'"write_files", "arguments": {"edits": [{"path": "", "search": "", "replace": "'
+                   b'"search_code", "arguments": {"query": "", "regex": false, "glob": null, "ignore_case": false}'
+                   b'"list_current_dir", "arguments": {}}}]}'
+                   b'\\n    def __init__(self, return None if else import from class \\n\\n'
+                   b'"thinking": "", "images": null, "tool_name": "'
+                   b'{"role": "tool", "content": "==> '
+                   b'{"role": "assistant", "content": "", "tool_calls": [{"id": "call_'
+                   b'{"role": "user", "content": "')]
+MATCH_FUZZY_THRESHOLD = 0.9
+DB_WRITE_RETRIES = 3
+DB_WRITE_BACKOFF = 1.0
+DIRTREE_INDEX_BATCH = 500
+DIRTREE_MTIME_SETTLE = 2
+SEARCH_INDEX_SLACK = 1000
\ No newline at end of file
@@ -1,24 +1,72 @@
 import os
+from functools import cached_property
 from .constants import DEFAULT_OLLAMA_MODEL
 from .db import DB
 from .dirtree import DirTree
-from .assistant import Assistant
-from .providers import xai, ollama
 from .logger import _logger
+from .constants import STATS_SLOWEST
+from .telemetry import summarize, encoding_savings
 
 class Context:
     @_logger
-    def __init__(self, cwd=os.getcwd()):
+    def __init__(self, cwd=None, persistent=False, model_name=None):
         self.db = DB()
-        self.cwd = cwd
-        self.dirtree = DirTree(cwd, self.db)
-        model = self.db.get_model(self.get_active_model())
-        self.assistant = Assistant.create(model["model_name"], model["provider"], model["settings"],
-                                          self.db, self.dirtree)
+        self.cwd = cwd or os.getcwd()
+        self.persistent = persistent
+        self.model_name = model_name
+        self.dirtree = DirTree(self.cwd, self.db)
+        self.model = None
+
+    @cached_property
+    def assistant(self):
+        from .assistant import Assistant
+        model_name = self.model_name or self.get_active_model()
+        self.model = self.db.get_model(model_name)
+        if self.model is None:
+            raise ValueError(f"No such model: {model_name}")
+        return Assistant.create(self.model["model_name"], self.model["provider"], self.model["settings"], self.db,
+                                self.dirtree)
+
+    @_logger
+    def refresh(self):
+        model = self.db.get_model(self.model_name or self.get_active_model())
+        if self.model is not None and tuple(self.model) != tuple(model or ()):
+            del self.assistant
+            self.model = None
+
+    @_logger
+    def prompt(self, prompt, stream=False):
+        return self.run_prompt(prompt, stream)
+
+    def run_prompt(self, prompt, stream=False):
+        telemetry = self.assistant.telemetry
+        try:
+            with telemetry.span("dirtree", "update_index"):
+                changes = self.dirtree.update_index()
+            if self.assistant.has_history():
+                with telemetry.span("dirtree", "describe_changes") as record:
+                    notice = self.dirtree.describe_changes(*changes)
+                    record["bytes_out"] = len(notice)
+            else:
+                with telemetry.span("dirtree", "manifest") as record:
+                    notice = self.dirtree.manifest()
+                    record["bytes_out"] = len(notice)
+            if notice:
+                prompt = f"{notice}\n\n{prompt}"
+            response = self.assistant.prompt(prompt, stream)
+            self._retain()
+            return response
+        finally:
+            telemetry.flush()
+
+    def _retain(self):
+        policy = self.db.get_retention(self.cwd)
+        if policy:
+            self.assistant.prune(policy["max_age"], policy["max_bytes"])
 
     @_logger
-    def prompt(self, prompt):
-        return self.assistant.prompt(prompt)
+    def start_session(self, writer=None):
+        self.assistant.start_session(writer)
 
     @_logger
     def get_models(self):
@@ -42,10 +90,51 @@ class Context:
         if model_name != DEFAULT_OLLAMA_MODEL:
             self.db.del_model(model_name)
 
+    @_logger
+    def compact(self):
+        return self.assistant.compact(force=True)
+
+    @_logger
+    def stats(self, all_contexts=False):
+        context = None if all_contexts else self.dirtree.cwd
+        rows = self.db.get_telemetry(context).fetchall()
+        return (summarize(rows), self.db.get_slowest_telemetry("tool", STATS_SLOWEST, context).fetchall(),
+                encoding_savings(rows))
+
+    @_logger
+    def history_stats(self, all_contexts=False):
+        rows = self.db.get_history_stats(None if all_contexts else self.cwd).fetchall()
+        return [(row, self.db.get_retention(row["context"])) for row in rows]
+
+    @_logger
+    def prune_history(self, all_contexts=False, max_age=None, max_bytes=None):
+        contexts = [row["context"] for row in self.db.get_history_stats()] if all_contexts else [self.cwd]
+        deleted = packed = 0
+        for context in contexts:
+            if max_age is None and max_bytes is None:
+                policy = self.db.get_retention(context)
+                if policy:
+                    deleted += self.db.prune_history(context, policy["max_age"], policy["max_bytes"])
+            else:
+                deleted += self.db.prune_history(context, max_age, max_bytes)
+            packed += self.db.pack_history(context)
+        return deleted, packed
+
+    @_logger
+    def set_retention(self, all_contexts=False, max_age=None, max_bytes=None):
+        self.db.set_retention("*" if all_contexts else self.cwd, max_age, max_bytes)
+
     @_logger
     def reset(self):
         self.assistant.reset()
 
+    @_logger
+    def maintain(self):
+        self.db.maintain()
+
     @_logger
     def close(self):
-        self.db.close()
\ No newline at end of file
+        if self.persistent:
+            self.db.commit()
+        else:
+            self.db.close()
\ No newline at end of file
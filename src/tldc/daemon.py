@@ -0,0 +1,211 @@
+import json
+import os
+import socket
+import socketserver
+import sys
+import threading
+from contextvars import ContextVar
+import click
+from .constants import DAEMON_SOCKET
+from .context import Context
+from .db import config_dir
+
+_streams = ContextVar("streams", default=None)
+
+def socket_path():
+    return os.path.join(config_dir(), DAEMON_SOCKET)
+
+class _Proxy:
+    def __init__(self, name, default):
+        self._name = name
+        self._default = default
+
+    def __getattr__(self, attr):
+        streams = _streams.get()
+        return getattr(streams[self._name] if streams else self._default, attr)
+
+class _Channel:
+    def __init__(self, rfile, wfile):
+        self.rfile = rfile
+        self.wfile = wfile
+
+    def send(self, message):
+        self.wfile.write(json.dumps(message).encode() + b"\n")
+        self.wfile.flush()
+
+    def receive(self):
+        line = self.rfile.readline()
+        if not line:
+            raise EOFError("client disconnected")
+        return json.loads(line)
+
+class _Writer:
+    encoding = "utf-8"
+    errors = "strict"
+
+    def __init__(self, channel, key):
+        self.channel = channel
+        self.key = key
+
+    def write(self, s):
+        if not isinstance(s, str):
+            raise TypeError("write() argument must be str")
+        if s:
+            self.channel.send({self.key: s})
+        return len(s)
+
+    def flush(self):
+        pass
+
+    def isatty(self):
+        return False
+
+class _Reader:
+    def __init__(self, channel):
+        self.channel = channel
+
+    def _request(self, kind):
+        self.channel.send({"stdin": kind})
+        return self.channel.receive()["data"]
+
+    def read(self, size=-1):
+        return self._request("read")
+
+    def readline(self, size=-1):
+        return self._request("readline")
+
+    def isatty(self):
+        return False
+
+class _Handler(socketserver.StreamRequestHandler):
+    def handle(self):
+        channel = _Channel(self.rfile, self.wfile)
+        try:
+            request = channel.receive()
+        except EOFError:
+            return
+        if request.get("stop"):
+            channel.send({"exit": 0})
+            threading.Thread(target=self.server.shutdown).start()
+            return
+        token = _streams.set({"stdout": _Writer(channel, "out"), "stderr": _Writer(channel, "err"),
+                              "stdin": _Reader(channel)})
+        try:
+            code = self.server.run(request["cwd"], request["argv"])
+        finally:
+            _streams.reset(token)
+        channel.send({"exit": code})
+
+class Daemon(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, path):
+        self.contexts = {}
+        self.lock = threading.Lock()
+        super().__init__(path, _Handler)
+        os.chmod(path, 0o600)
+
+    def context(self, cwd):
+        with self.lock:
+            if cwd not in self.contexts:
+                self.contexts[cwd] = (Context(cwd, persistent=True), threading.Lock())
+            return self.contexts[cwd]
+
+    def run(self, cwd, argv):
+        from .main import main
+        try:
+            context, lock = self.context(cwd)
+            with lock:
+                context.refresh()
+                main.main(args=argv, prog_name="tldc", obj=context, standalone_mode=False)
+            return 0
+        except SystemExit as e:
+            return e.code if isinstance(e.code, int) else int(e.code is not None)
+        except click.exceptions.Exit as e:
+            return e.exit_code
+        except click.ClickException as e:
+            e.show()
+            return e.exit_code
+        except click.Abort:
+            print("Aborted!", file=sys.stderr)
+            return 1
+
+    def server_close(self):
+        super().server_close()
+        for context, lock in self.contexts.values():
+            with lock:
+                context.db.close()
+        self.contexts = {}
+
+def serve():
+    path = socket_path()
+    if os.path.exists(path):
+        if ping():
+            raise RuntimeError(f"Daemon already running at {path}")
+        os.unlink(path)
+    sys.stdout = _Proxy("stdout", sys.stdout)
+    sys.stderr = _Proxy("stderr", sys.stderr)
+    sys.stdin = _Proxy("stdin", sys.stdin)
+    server = Daemon(path)
+    print(f"Listening on {path}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        os.unlink(path)
+        sys.stdout, sys.stderr, sys.stdin = sys.__stdout__, sys.__stderr__, sys.__stdin__
+
+def _connect():
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(socket_path())
+    except OSError:
+        sock.close()
+        return None
+    return sock
+
+def ping():
+    sock = _connect()
+    if sock is None:
+        return False
+    sock.close()
+    return True
+
+def stop():
+    sock = _connect()
+    if sock is None:
+        return False
+    with sock, sock.makefile("rwb") as file:
+        channel = _Channel(file, file)
+        channel.send({"stop": True})
+        channel.receive()
+    return True
+
+def forward(argv, cwd):
+    sock = _connect()
+    if sock is None:
+        return None
+    with sock, sock.makefile("rwb") as file:
+        channel = _Channel(file, file)
+        try:
+            channel.send({"argv": argv, "cwd": cwd})
+        except OSError:
+            return None
+        while True:
+            try:
+                message = channel.receive()
+            except EOFError:
+                return 1
+            if "out" in message:
+                sys.stdout.write(message["out"])
+                sys.stdout.flush()
+            elif "err" in message:
+                sys.stderr.write(message["err"])
+                sys.stderr.flush()
+            elif "stdin" in message:
+                data = sys.stdin.read() if message["stdin"] == "read" else sys.stdin.readline()
+                channel.send({"data": data})
+            elif "exit" in message:
+                return message["exit"]
@@ -1,44 +1,262 @@
+import json
 import os
+import queue
 import sqlite3
+import threading
+import time
+import zlib
+from contextlib import contextmanager
 from .constants import DEFAULT_OLLAMA_MODEL, DEFAULT_OLLAMA_SETTINGS
+from .constants import DB_BUSY_TIMEOUT, DB_VACUUM_FREELIST_RATIO, DB_VACUUM_MIN_PAGES
+from .constants import DB_WRITE_RETRIES, DB_WRITE_BACKOFF
+from .constants import READ_CACHE_MAX_BYTES
+from .constants import HISTORY_COMPRESS_LEVEL, HISTORY_ZDICTS
+from .logger import logger
+
+def config_dir():
+    confdir = os.environ["HOME"] + "/.config/tldc"
+    os.makedirs(confdir, exist_ok=True)
+    return confdir
+
+def pack_message(message):
+    data = message.encode()
+    # The tag byte is the 1-based HISTORY_ZDICTS entry the row was compressed with, so dictionaries are only appended
+    compressor = zlib.compressobj(HISTORY_COMPRESS_LEVEL, zdict=HISTORY_ZDICTS[-1])
+    packed = bytes([len(HISTORY_ZDICTS)]) + compressor.compress(data) + compressor.flush()
+    return packed if len(packed) < len(data) else message
+
+def unpack_message(value):
+    if isinstance(value, str):
+        return value
+    if not 1 <= value[0] <= len(HISTORY_ZDICTS):
+        raise ValueError(f"Unknown history encoding: {value[:1]!r}")
+    decompressor = zlib.decompressobj(zdict=HISTORY_ZDICTS[value[0] - 1])
+    return (decompressor.decompress(value[1:]) + decompressor.flush()).decode()
+
+def _history_row(context, message, created):
+    try:
+        role = json.loads(message).get("role")
+    except (ValueError, AttributeError):
+        role = None
+    return {"context": context, "message": pack_message(message), "role": role, "created": created,
+            "size": len(message.encode())}
 
 class DB:
     def __init__(self):
-        confdir = os.environ["HOME"] + "/.config/tldc"
-        os.makedirs(confdir, exist_ok=True)
-        self.connection = sqlite3.connect(confdir + "/tldc.db")
+        self.connection = sqlite3.connect(config_dir() + "/tldc.db", timeout=DB_BUSY_TIMEOUT, check_same_thread=False)
         self.connection.row_factory = sqlite3.Row
-        self.connection.executescript("""
+        self.lock = threading.RLock()
+        self.batch = 0
+        self.writer = None
+        self.own_writer = False
+        self.connection.executescript(f"""
+                                      PRAGMA busy_timeout = {int(DB_BUSY_TIMEOUT * 1000)};
+                                      PRAGMA journal_mode = WAL;
+                                      PRAGMA synchronous = NORMAL;
                                       CREATE TABLE IF NOT EXISTS config (key primary key, value);
                                       CREATE TABLE IF NOT EXISTS models (model_name primary key, provider, settings);
                                       CREATE TABLE IF NOT EXISTS contexts (context primary key, response_id);
-                                      CREATE TABLE IF NOT EXISTS history (context, message);
+                                      CREATE TABLE IF NOT EXISTS history (context, message, role, created, size);
+                                      CREATE TABLE IF NOT EXISTS retention (context primary key, max_age, max_bytes);
+                                      CREATE TABLE IF NOT EXISTS files (context, path, size, mtime, inode, hash,
+                                                                        PRIMARY KEY (context, path));
+                                      CREATE TABLE IF NOT EXISTS reads (context, path, mtime, size, hash, content, atime,
+                                                                        PRIMARY KEY (context, path));
+                                      CREATE TABLE IF NOT EXISTS dirs (context, path, mtime, ignore,
+                                                                       PRIMARY KEY (context, path));
+                                      CREATE TABLE IF NOT EXISTS code_paths (id INTEGER PRIMARY KEY, context, path,
+                                                                             UNIQUE (context, path));
+                                      CREATE TABLE IF NOT EXISTS telemetry (run, context, model, kind, name, started,
+                                                                            duration, bytes_in, bytes_out,
+                                                                            prompt_tokens, completion_tokens, meta);
+                                      CREATE TABLE IF NOT EXISTS manifests (context primary key, fingerprint,
+                                                                            manifest);
+                                      CREATE TABLE IF NOT EXISTS responses (key PRIMARY KEY, model, request, response,
+                                                                            created);
+                                      CREATE INDEX IF NOT EXISTS history_context ON history (context);
+                                      CREATE INDEX IF NOT EXISTS telemetry_context ON telemetry (context);
+                                      CREATE INDEX IF NOT EXISTS telemetry_name ON telemetry (kind, name, started);
                                       """)
-        self.connection.execute("REPLACE INTO models VALUES(:model_name, 'ollama', :settings)",
+        code = self.connection.execute("SELECT sql FROM sqlite_master WHERE name = 'code'").fetchone()
+        if code and "fts5" in code["sql"] and "content=''" not in code["sql"]:
+            self.connection.executescript("DROP TABLE code; DELETE FROM code_paths;")
+        try:
+            self.connection.execute("CREATE VIRTUAL TABLE IF NOT EXISTS code USING fts5(content, content='', "
+                                    "tokenize='trigram')")
+            self.fts = True
+        except sqlite3.OperationalError:
+            self.connection.execute("CREATE TABLE IF NOT EXISTS code (content)")
+            self.fts = False
+        if "role" not in {row["name"] for row in self.connection.execute("PRAGMA table_info(history)")}:
+            self.connection.executescript("""
+                                          ALTER TABLE history ADD COLUMN role;
+                                          ALTER TABLE history ADD COLUMN created;
+                                          ALTER TABLE history ADD COLUMN size;
+                                          UPDATE history SET role = CASE WHEN json_valid(message)
+                                                                         THEN json_extract(message, '$.role') END,
+                                                             created = CAST(strftime('%s', 'now') AS REAL),
+                                                             size = length(CAST(message AS BLOB));
+                                          """)
+        self.connection.execute("INSERT OR IGNORE INTO models VALUES(:model_name, 'ollama', :settings)",
                                 {"model_name": DEFAULT_OLLAMA_MODEL, "settings": DEFAULT_OLLAMA_SETTINGS})
         self.connection.commit()
 
-    def close(self):
+    def close(self, maintain=True):
+        try:
+            self.stop_writer()
+        finally:
+            self.commit()
+            if maintain:
+                if self.needs_maintenance():
+                    try:
+                        self.maintain()
+                    except sqlite3.OperationalError:
+                        pass
+                self.connection.execute("PRAGMA optimize")
+            self.connection.close()
+
+    def commit(self):
+        if not self.batch:
+            self.connection.commit()
+
+    @contextmanager
+    def transaction(self):
+        self.batch += 1
+        try:
+            yield
+        except BaseException:
+            if self.batch == 1:
+                self.connection.rollback()
+            raise
+        finally:
+            self.batch -= 1
+            self.commit()
+
+    def start_writer(self, writer=None):
+        if self.writer is None:
+            self.own_writer = writer is None
+            self.writer = writer or Writer()
+            if self.own_writer:
+                self.writer.start()
+
+    def stop_writer(self):
+        if self.writer is not None:
+            writer, self.writer = self.writer, None
+            if self.own_writer:
+                writer.stop()
+                writer.check()
+
+    def defer(self, job):
+        if self.writer is None:
+            job(self)
+        else:
+            self.writer.check()
+            self.writer.jobs.put(job)
+
+    def flush(self):
+        if self.writer is not None:
+            done = threading.Event()
+            self.writer.jobs.put(lambda db: done.set())
+            done.wait()
+            self.writer.check()
+
+    def needs_maintenance(self):
+        pages = self.connection.execute("PRAGMA page_count").fetchone()[0]
+        free = self.connection.execute("PRAGMA freelist_count").fetchone()[0]
+        return pages >= DB_VACUUM_MIN_PAGES and free >= pages * DB_VACUUM_FREELIST_RATIO
+
+    def maintain(self):
+        self.connection.commit()
         self.connection.executescript("""
-                                      VACUUM config;
-                                      VACUUM models;
-                                      VACUUM contexts;
-                                      VACUUM history;
+                                      VACUUM;
+                                      ANALYZE;
+                                      PRAGMA wal_checkpoint(TRUNCATE);
                                       """)
-        self.connection.close()
 
     def get_history(self, context):
-        return self.connection.execute("SELECT rowid, message FROM history WHERE context = :context",
-                                       {"context": context})
+        return [unpack_message(row["message"]) for row in
+                self.connection.execute("SELECT message FROM history WHERE context = :context ORDER BY rowid",
+                                        {"context": context})]
+
+    def has_history(self, context):
+        return self.connection.execute("SELECT 1 FROM history WHERE context = :context LIMIT 1",
+                                       {"context": context}).fetchone() is not None
 
     def add_history(self, context, message):
-        self.connection.execute("INSERT INTO history VALUES(:context, :message)", {"context": context,
-                                                                                   "message": message})
-        self.connection.commit()
+        self.connection.execute("INSERT INTO history VALUES(:context, :message, :role, :created, :size)",
+                                _history_row(context, message, time.time()))
+        self.commit()
 
     def del_history(self, context):
         self.connection.execute("DELETE FROM history WHERE context = :context", {"context": context})
-        self.connection.commit()
+        self.commit()
+
+    def set_history(self, context, messages):
+        created = time.time()
+        with self.transaction():
+            self.connection.execute("DELETE FROM history WHERE context = :context", {"context": context})
+            self.connection.executemany("INSERT INTO history VALUES(:context, :message, :role, :created, :size)",
+                                        [_history_row(context, m, created) for m in messages])
+
+    def get_history_stats(self, context=None):
+        return self.connection.execute("""SELECT context, COUNT(*) AS messages, SUM(role = 'user') AS turns,
+                                                 SUM(size) AS size, SUM(length(CAST(message AS BLOB))) AS stored,
+                                                 MIN(created) AS oldest, MAX(created) AS newest
+                                          FROM history WHERE :context IS NULL OR context = :context
+                                          GROUP BY context ORDER BY context""", {"context": context})
+
+    def get_retention(self, context):
+        return self.connection.execute("""SELECT max_age, max_bytes FROM retention WHERE context IN (:context, '*')
+                                          ORDER BY context = '*' LIMIT 1""", {"context": context}).fetchone()
+
+    def set_retention(self, context, max_age, max_bytes):
+        if max_age is None and max_bytes is None:
+            self.connection.execute("DELETE FROM retention WHERE context = :context", {"context": context})
+        else:
+            self.connection.execute("REPLACE INTO retention VALUES(:context, :max_age, :max_bytes)",
+                                    {"context": context, "max_age": max_age, "max_bytes": max_bytes})
+        self.commit()
+
+    def prune_history(self, context, max_age=None, max_bytes=None):
+        params = {"context": context}
+        last = self.connection.execute("""SELECT MAX(rowid), MAX(CASE WHEN role = 'user' THEN rowid END)
+                                          FROM history WHERE context = :context""", params).fetchone()
+        if last[0] is None:
+            return 0
+        cuts = []
+        if max_age is not None:
+            params["cutoff"] = time.time() - max_age * 86400
+            first = self.connection.execute("""SELECT MIN(rowid) FROM history WHERE context = :context
+                                               AND role = 'user' AND created >= :cutoff""", params).fetchone()[0]
+            cut = last[0] + 1 if first is None else first
+            cuts.append(cut if last[1] is None else min(cut, last[1]))
+        if max_bytes is not None:
+            params["max_bytes"] = max_bytes
+            first = self.connection.execute("""SELECT MIN(rowid) FROM (SELECT rowid, role,
+                                                      SUM(size) OVER (ORDER BY rowid DESC) AS total
+                                                      FROM history WHERE context = :context)
+                                               WHERE role = 'user' AND total <= :max_bytes""", params).fetchone()[0]
+            cuts.append(first or last[1] or 0)
+        if not cuts:
+            return 0
+        params["cut"] = max(cuts)
+        with self.transaction():
+            deleted = self.connection.execute("DELETE FROM history WHERE context = :context AND rowid < :cut",
+                                              params).rowcount
+            if deleted:
+                self.connection.execute("DELETE FROM contexts WHERE context = :context", params)
+                self.del_reads(context)
+        return deleted
+
+    def pack_history(self, context):
+        rows = self.connection.execute("""SELECT rowid, message FROM history
+                                          WHERE context = :context AND typeof(message) = 'text'""",
+                                       {"context": context}).fetchall()
+        packed = [{"rowid": row["rowid"], "message": pack_message(row["message"])} for row in rows]
+        packed = [row for row in packed if isinstance(row["message"], bytes)]
+        with self.transaction():
+            self.connection.executemany("UPDATE history SET message = :message WHERE rowid = :rowid", packed)
+        return len(packed)
 
     def get_response_id(self, context):
         result = self.connection.execute("SELECT response_id FROM contexts WHERE context = :context",
@@ -48,11 +266,168 @@ class DB:
     def set_response_id(self, context, response_id):
         self.connection.execute("REPLACE INTO contexts VALUES(:context, :response_id)",
                                 {"context": context, "response_id": response_id})
-        self.connection.commit()
+        self.commit()
 
     def reset_response_id(self, context):
         self.connection.execute("DELETE FROM contexts WHERE context = :context", {"context": context})
-        self.connection.commit()
+        self.commit()
+
+    def get_files(self, context):
+        return self.connection.execute("SELECT path, size, mtime, inode, hash FROM files WHERE context = :context",
+                                       {"context": context})
+
+    def update_files(self, context, changed, removed):
+        with self.lock:
+            self.connection.executemany("REPLACE INTO files VALUES(:context, :path, :size, :mtime, :inode, :hash)",
+                                        [{"context": context, **f} for f in changed])
+            self.connection.executemany("DELETE FROM files WHERE context = :context AND path = :path",
+                                        [{"context": context, "path": p} for p in removed])
+            self.commit()
+
+    def get_dirs(self, context):
+        return self.connection.execute("SELECT path, mtime, ignore FROM dirs WHERE context = :context",
+                                       {"context": context})
+
+    def update_dirs(self, context, changed, removed):
+        with self.lock:
+            self.connection.executemany("REPLACE INTO dirs VALUES(:context, :path, :mtime, :ignore)",
+                                        [{"context": context, **d} for d in changed])
+            self.connection.executemany("DELETE FROM dirs WHERE context = :context AND path = :path",
+                                        [{"context": context, "path": p} for p in removed])
+            self.commit()
+
+    def get_code_paths(self, context):
+        return {row["path"] for row in self.connection.execute("SELECT path FROM code_paths WHERE context = :context",
+                                                               {"context": context})}
+
+    def update_code(self, context, contents, removed):
+        # code is contentless, so replaced rows are orphaned rather than deleted until prune_code rebuilds it
+        with self.lock, self.transaction():
+            if not self.fts:
+                self.connection.executemany("DELETE FROM code WHERE rowid = (SELECT id FROM code_paths "
+                                            "WHERE context = :context AND path = :path)",
+                                            [{"context": context, "path": p} for p in [*removed, *contents]])
+            self.connection.executemany("DELETE FROM code_paths WHERE context = :context AND path = :path",
+                                        [{"context": context, "path": p} for p in removed])
+            for path, content in contents.items():
+                code_id = self.connection.execute("INSERT INTO code (content) VALUES(:content)",
+                                                  {"content": content}).lastrowid
+                self.connection.execute("REPLACE INTO code_paths VALUES(:id, :context, :path)",
+                                        {"id": code_id, "context": context, "path": path})
+
+    def prune_code(self, slack):
+        if not self.fts:
+            return False
+        with self.lock, self.transaction():
+            rows = self.connection.execute("SELECT COUNT(*) FROM code").fetchone()[0]
+            live = self.connection.execute("SELECT COUNT(*) FROM code_paths").fetchone()[0]
+            if rows > 2 * live + slack:
+                self.connection.execute("INSERT INTO code (code) VALUES('delete-all')")
+                self.connection.execute("DELETE FROM code_paths")
+                return True
+        return False
+
+    def search_code(self, context, literal, limit, keep=None):
+        params = {"context": context, "literal": literal}
+        if literal and self.fts and len(literal) >= 3:
+            params["literal"] = '"' + literal.replace('"', '""') + '"'
+            query = ("SELECT p.path FROM code c JOIN code_paths p ON p.id = c.rowid "
+                     "WHERE code MATCH :literal AND p.context = :context ORDER BY c.rank")
+        elif literal and not self.fts:
+            query = ("SELECT p.path FROM code_paths p JOIN code c ON c.rowid = p.id "
+                     "WHERE p.context = :context AND instr(lower(c.content), lower(:literal))")
+        else:
+            query = "SELECT path FROM code_paths WHERE context = :context ORDER BY path"
+        paths = []
+        with self.lock:
+            cursor = self.connection.execute(query, params)
+            for row in cursor:
+                if keep is None or keep(row["path"]):
+                    paths.append(row["path"])
+                    if len(paths) >= limit:
+                        break
+            cursor.close()
+        return paths
+
+    def get_manifest(self, context, fingerprint):
+        result = self.connection.execute("SELECT manifest FROM manifests "
+                                         "WHERE context = :context AND fingerprint = :fingerprint",
+                                         {"context": context, "fingerprint": fingerprint}).fetchone()
+        return result["manifest"] if result else None
+
+    def set_manifest(self, context, fingerprint, manifest):
+        self.connection.execute("REPLACE INTO manifests VALUES(:context, :fingerprint, :manifest)",
+                                {"context": context, "fingerprint": fingerprint, "manifest": manifest})
+        self.commit()
+
+    def get_read(self, context, path):
+        with self.lock:
+            return self.connection.execute("SELECT mtime, size, hash, content FROM reads "
+                                           "WHERE context = :context AND path = :path",
+                                           {"context": context, "path": path}).fetchone()
+
+    def set_read(self, context, path, mtime, size, hash, content):
+        with self.lock, self.transaction():
+            self.connection.execute("REPLACE INTO reads VALUES(:context, :path, :mtime, :size, :hash, :content, :atime)",
+                                    {"context": context, "path": path, "mtime": mtime, "size": size, "hash": hash,
+                                     "content": content, "atime": time.time()})
+            self.connection.execute("""
+                                    DELETE FROM reads WHERE context = :context AND path IN (
+                                        SELECT path FROM (
+                                            SELECT path, SUM(length(content)) OVER (ORDER BY atime DESC) AS total
+                                            FROM reads WHERE context = :context)
+                                        WHERE total > :max_bytes)
+                                    """, {"context": context, "max_bytes": READ_CACHE_MAX_BYTES})
+
+    def touch_read(self, context, path, mtime):
+        with self.lock:
+            self.connection.execute("UPDATE reads SET mtime = :mtime, atime = :atime "
+                                    "WHERE context = :context AND path = :path",
+                                    {"context": context, "path": path, "mtime": mtime, "atime": time.time()})
+            self.commit()
+
+    def del_read(self, context, path):
+        with self.lock:
+            self.connection.execute("DELETE FROM reads WHERE context = :context AND path = :path",
+                                    {"context": context, "path": path})
+            self.commit()
+
+    def del_reads(self, context):
+        with self.lock:
+            self.connection.execute("DELETE FROM reads WHERE context = :context", {"context": context})
+            self.commit()
+
+    def add_telemetry(self, events):
+        with self.lock:
+            self.connection.executemany("INSERT INTO telemetry VALUES(:run, :context, :model, :kind, :name, :started, "
+                                        ":duration, :bytes_in, :bytes_out, :prompt_tokens, :completion_tokens, :meta)",
+                                        events)
+            self.commit()
+
+    def get_telemetry(self, context=None):
+        if context:
+            return self.connection.execute("SELECT * FROM telemetry WHERE context = :context", {"context": context})
+        return self.connection.execute("SELECT * FROM telemetry")
+
+    def get_slowest_telemetry(self, kind, limit, context=None):
+        return self.connection.execute("SELECT * FROM telemetry WHERE kind = :kind "
+                                       "AND (:context IS NULL OR context = :context) "
+                                       "ORDER BY duration DESC LIMIT :limit",
+                                       {"kind": kind, "context": context, "limit": limit})
+
+    def get_durations(self, kind, name, limit):
+        return [row["duration"] for row in self.connection.execute(
+            "SELECT duration FROM telemetry WHERE kind = :kind AND name = :name ORDER BY started DESC LIMIT :limit",
+            {"kind": kind, "name": name, "limit": limit})]
+
+    def get_response(self, key):
+        return self.connection.execute("SELECT response FROM responses WHERE key = :key", {"key": key}).fetchone()
+
+    def set_response(self, key, model, request, response):
+        self.connection.execute("REPLACE INTO responses VALUES(:key, :model, :request, :response, :created)",
+                                {"key": key, "model": model, "request": request, "response": response,
+                                 "created": time.time()})
+        self.commit()
 
     def get_config_value(self, key):
         result = self.connection.execute("SELECT value FROM config WHERE key = :key",
@@ -62,7 +437,7 @@ class DB:
     def set_config_value(self, key, value):
         self.connection.execute("REPLACE INTO config VALUES(:key, :value)",
                                 {"key": key, "value": value})
-        self.connection.commit()
+        self.commit()
 
     def get_models(self):
         return self.connection.execute("SELECT model_name, provider, settings FROM models")
@@ -73,9 +448,45 @@ class DB:
     def add_model(self, model_name, provider, settings):
         self.connection.execute("REPLACE INTO models VALUES(:model_name, :provider, :settings)",
                                 {"model_name": model_name, "provider": provider, "settings": settings})
-        self.connection.commit()
+        self.commit()
 
     def del_model(self, model_name):
         self.connection.execute("DELETE FROM models WHERE model_name = :model_name",
                                 {"model_name": model_name})
-        self.connection.commit()
+        self.commit()
+
+class Writer(threading.Thread):
+    def __init__(self):
+        super().__init__(daemon=True)
+        self.jobs = queue.Queue()
+        self.error = None
+
+    def _run_job(self, db, job):
+        for attempt in range(DB_WRITE_RETRIES + 1):
+            try:
+                return job(db)
+            except sqlite3.OperationalError as e:
+                if attempt == DB_WRITE_RETRIES or "locked" not in str(e):
+                    raise
+                logger(f"Background write failed, retrying: {repr(e)}", "warn")
+                time.sleep(DB_WRITE_BACKOFF * 2 ** attempt)
+
+    def run(self):
+        db = DB()
+        while (job := self.jobs.get()) is not None:
+            try:
+                self._run_job(db, job)
+            except sqlite3.Error as e:
+                logger(f"Background write failed: {repr(e)}", "error")
+                self.error = self.error or e
+        db.connection.commit()
+        db.connection.close()
+
+    def check(self):
+        if self.error is not None:
+            error, self.error = self.error, None
+            raise RuntimeError(f"Background write failed: {repr(error)}") from error
+
+    def stop(self):
+        self.jobs.put(None)
+        self.join()
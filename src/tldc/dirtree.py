@@ -1,15 +1,33 @@
 from pathlib import Path
+from collections import defaultdict
 from hashlib import md5
+from difflib import unified_diff
+from fnmatch import fnmatch
+import codecs
+import mmap
 import os
-from .constants import DIRTREE_EXCLUDE
-from .constants import DIRTREE_EXCLUDE_ANYWHERE
+import re
+import secrets
+import stat
+import time
+from .constants import DIRTREE_HASH_CHUNK_SIZE, DIRTREE_INDEX_BATCH, DIRTREE_MTIME_SETTLE
+from .constants import READ_CACHE_DIFF
+from .constants import CHANGES_MAX_PATHS, CHANGES_MAX_FILE_DIFF, CHANGES_MAX_BYTES
+from .constants import MANIFEST_FILES, MANIFEST_MAX_DEPTH, MANIFEST_MAX_ENTRIES, MANIFEST_FILE_MAX_BYTES
+from .constants import MANIFEST_MAX_BYTES
+from .constants import DIRTREE_READ_MAX_BYTES, DIRTREE_BINARY_CHECK_BYTES, BINARY_SIGNATURES
+from .constants import SEARCH_MAX_FILE_BYTES, SEARCH_MAX_FILES, SEARCH_MAX_RESULTS, SEARCH_MAX_LINE
+from .constants import SEARCH_INDEX_SLACK
 from .db import DB
+from .ignore import IgnoreMatcher
 from .logger import logger
+from .match import LineIndex, apply_edit
 
 class DirTree:
     def __init__(self, cwd, db: DB):
         self.cwd = os.path.abspath(cwd)
         self.db = db
+        self.ignore = IgnoreMatcher(self.cwd)
 
     def _to_relative(self, fullp: str) -> str:
         return str(Path(fullp).relative_to(self.cwd))
@@ -17,16 +35,23 @@ class DirTree:
     def _from_relative(self, rel: str) -> str:
         return str(Path(f"{self.cwd}/{rel}").resolve())
 
-    def read_file(self, p: str):
+    def read_file(self, p: str, start_line=None, end_line=None, offset=None, length=None, line_numbers=False):
         fullp = self._from_relative(p)
         pp = Path(fullp)
-        if fullp.startswith(f"{self.cwd}/") and ".git" not in fullp[len(self.cwd):]:
+        if fullp.startswith(f"{self.cwd}/") and ".git" not in fullp[len(self.cwd):] and self.check_path(pp):
             if pp.exists():
                 if pp.is_file():
                     logger(f"Reading {p}")
-                    with open(fullp, "r") as file:
-                        data = file.read()
-                    return data
+                    size = os.path.getsize(fullp)
+                    binary = self._binary_kind(fullp)
+                    if binary:
+                        logger(f"AI tried to read {p}, {binary}", "warn")
+                        return f"Trying to read {p}: {binary}, {size} bytes"
+                    if offset is not None or length is not None:
+                        return self._read_bytes(p, fullp, offset or 0, length)
+                    if start_line is not None or end_line is not None or size > DIRTREE_READ_MAX_BYTES:
+                        return self._read_lines(p, fullp, start_line or 1, end_line, line_numbers)
+                    return self._read_cached(p, fullp, line_numbers)
                 else:
                     logger(f"AI tried to read {p}, is a directory", "warn")
                     return f"Trying to read {p}: is a directory"
@@ -37,38 +62,206 @@ class DirTree:
             logger(f"AI tried to read {p}, access denied", "warn")
             return f"Trying to read {p}: access denied"
 
-    def write_file(self, p: str, search: str, replace: str):
+    def _binary_kind(self, fullp: str):
+        with open(fullp, "rb") as file:
+            return self._binary_kind_of(file.read(DIRTREE_BINARY_CHECK_BYTES))
+
+    def _binary_kind_of(self, head: bytes):
+        for signature, kind in BINARY_SIGNATURES.items():
+            if head.startswith(signature):
+                return kind
+        if b"\0" in head:
+            return "binary file"
+        try:
+            codecs.getincrementaldecoder("utf-8")().decode(head, final=False)
+        except UnicodeDecodeError:
+            return "binary file"
+        return None
+
+    def _count_lines(self, mm):
+        lines = 0
+        for pos in range(0, len(mm), DIRTREE_HASH_CHUNK_SIZE):
+            lines += mm[pos:pos + DIRTREE_HASH_CHUNK_SIZE].count(b"\n")
+        return lines + 1 if len(mm) and mm[-1:] != b"\n" else lines
+
+    def _line_offset(self, mm, line: int):
+        remaining = line - 1
+        for pos in range(0, len(mm), DIRTREE_HASH_CHUNK_SIZE):
+            if remaining <= 0:
+                return pos
+            chunk = mm[pos:pos + DIRTREE_HASH_CHUNK_SIZE]
+            newlines = chunk.count(b"\n")
+            if newlines >= remaining:
+                index = -1
+                for _ in range(remaining):
+                    index = chunk.find(b"\n", index + 1)
+                return pos + index + 1
+            remaining -= newlines
+        return len(mm)
+
+    def _number_lines(self, data: str, start: int):
+        return "".join(f"{n}\t{line}" for n, line in enumerate(data.splitlines(keepends=True), start))
+
+    def _read_lines(self, p: str, fullp: str, start: int, end, line_numbers=False):
+        if os.path.getsize(fullp) == 0:
+            return f"{p}: empty file"
+        with open(fullp, "rb") as file, mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            total = self._count_lines(mm)
+            start = max(start, 1)
+            end = min(end or total, total)
+            if start > end:
+                return f"{p}: no lines in range, file has {total} lines"
+            begin = self._line_offset(mm, start)
+            finish = self._line_offset(mm, end + 1)
+            capped = finish - begin > DIRTREE_READ_MAX_BYTES
+            if capped:
+                finish = mm.rfind(b"\n", begin, begin + DIRTREE_READ_MAX_BYTES) + 1 or begin + DIRTREE_READ_MAX_BYTES
+            data = mm[begin:finish].decode(errors="replace")
+        last = start + data.count("\n") - 1 if data.endswith("\n") else start + data.count("\n")
+        header = f"{p}: lines {start}-{last} of {total}"
+        if capped and not data.endswith("\n"):
+            header += (f", output capped at {DIRTREE_READ_MAX_BYTES} bytes in the middle of line {last}, "
+                       f"it continues at byte offset {finish}, use offset and length to read more")
+        elif capped:
+            header += f", output capped at {DIRTREE_READ_MAX_BYTES} bytes, use start_line and end_line to read more"
+        return f"{header}\n{self._number_lines(data, start) if line_numbers else data}"
+
+    def _read_bytes(self, p: str, fullp: str, offset: int, length):
+        size = os.path.getsize(fullp)
+        if size == 0:
+            return f"{p}: empty file"
+        length = min(length or DIRTREE_READ_MAX_BYTES, DIRTREE_READ_MAX_BYTES)
+        with open(fullp, "rb") as file, mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            total = self._count_lines(mm)
+            data = mm[offset:offset + length]
+        return f"{p}: bytes {offset}-{offset + len(data)} of {size}, {total} lines\n{data.decode(errors='replace')}"
+
+    def _read_cached(self, p: str, fullp: str, line_numbers=False):
+        rel = self._to_relative(fullp)
+        st = os.stat(fullp)
+        cached = self.db.get_read(self.cwd, rel)
+        if cached and (cached["mtime"], cached["size"]) == (st.st_mtime_ns, st.st_size):
+            self.db.touch_read(self.cwd, rel, st.st_mtime_ns)
+            return f"{p} is unchanged since your last read in this conversation."
+        with open(fullp, "r", newline="", errors="replace") as file:
+            data = file.read()
+        data_hash = md5(data.encode()).hexdigest()
+        if cached and cached["hash"] == data_hash:
+            self.db.touch_read(self.cwd, rel, st.st_mtime_ns)
+            return f"{p} is unchanged since your last read in this conversation."
+        self.db.set_read(self.cwd, rel, st.st_mtime_ns, st.st_size, data_hash, data)
+        if cached and READ_CACHE_DIFF:
+            diff = "".join(unified_diff(cached["content"].splitlines(keepends=True), data.splitlines(keepends=True),
+                                        f"a/{rel}", f"b/{rel}"))
+            if len(diff) < len(data):
+                return f"{p} changed since your last read in this conversation:\n{diff}"
+        return self._number_lines(data, 1) if line_numbers else data
+
+    def _writable(self, p: str):
         fullp = self._from_relative(p)
         if fullp.startswith(f"{self.cwd}/") and ".git" not in fullp[len(self.cwd):]:
-            pp = Path(fullp)
-            dirp = pp.parent
-            os.makedirs(str(dirp), exist_ok=True)
-            if pp.exists() and pp.is_file():
-                with open(fullp, "r") as file:
-                    data = file.read()
-            elif search != "":
-                logger(f"AI tried to update {p}, no such file", "warn")
-                return f"Trying to update {p}: no such file"
-            if search == "":
-                logger(f"Creating {p}")
-                data = replace
-            else:
-                logger(f"Updating {p}")
-                if data.count(search) != 1:
-                    search = search.replace(r'\"', '"')
-                    if data.count(search) != 1:
-                        logger(f"AI tried to update {p}, search matches != 1", "warn")
-                        return f"Trying to update {p}: search matches != 1"
-                    else:
-                        data = data.replace(search, replace)
-                else:
-                    data = data.replace(search, replace)
-            with open(fullp, "w") as file:
+            return fullp
+        logger(f"AI tried to write {p}, access denied", "warn")
+        return None
+
+    def _load(self, fullp: str):
+        pp = Path(fullp)
+        if pp.exists() and pp.is_file():
+            with open(fullp, "r", newline="") as file:
+                return file.read()
+        return None
+
+    def _save(self, fullp: str, data: str):
+        directory = os.path.dirname(fullp)
+        os.makedirs(directory, exist_ok=True)
+        try:
+            mode = stat.S_IMODE(os.stat(fullp).st_mode)
+        except FileNotFoundError:
+            mode = None
+        # Created like open() would, so the umask applies to new files
+        tmp = f"{directory}/.{os.path.basename(fullp)}.{secrets.token_hex(8)}.tmp"
+        fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o666)
+        try:
+            with os.fdopen(fd, "w", newline="") as file:
                 file.write(data)
-            return "OK"
-        else:
-            logger(f"AI tried to write {p}, access denied", "warn")
+                file.flush()
+                os.fsync(file.fileno())
+            if mode is not None:
+                os.chmod(tmp, mode)
+            os.replace(tmp, fullp)
+        except BaseException:
+            os.unlink(tmp)
+            raise
+
+    def _remember(self, rel: str, fullp: str, data: str, exact=True):
+        if not exact:
+            self.db.del_read(self.cwd, rel)
+        elif self.db.get_read(self.cwd, rel):
+            st = os.stat(fullp)
+            self.db.set_read(self.cwd, rel, st.st_mtime_ns, st.st_size, md5(data.encode()).hexdigest(), data)
+
+    def _apply_edit(self, p: str, data, search: str, replace: str):
+        if search == "":
+            return replace, "OK", True
+        if data is None:
+            logger(f"AI tried to update {p}, no such file", "warn")
+            return None, f"Trying to update {p}: no such file", False
+        try:
+            data, match = apply_edit(LineIndex(data), search, replace)
+        except ValueError as e:
+            logger(f"AI tried to update {p}, {e}", "warn")
+            return None, f"Trying to update {p}: {e}", False
+        if match.kind != "exact":
+            logger(f"{p}: {match.describe()}")
+            return data, f"OK, {match.describe()}, reread the file to see the result", False
+        return data, f"OK, {match.describe()}", True
+
+    def write_file(self, p: str, search: str, replace: str):
+        fullp = self._writable(p)
+        if fullp is None:
             return f"Trying to write {p}: access denied"
+        logger(f"Creating {p}" if search == "" else f"Updating {p}")
+        data, result, exact = self._apply_edit(p, self._load(fullp), search, replace)
+        if data is None:
+            return result
+        self._save(fullp, data)
+        self._remember(self._to_relative(fullp), fullp, data, exact)
+        self._index_paths([self._to_relative(fullp)])
+        return result
+
+    def write_files(self, edits):
+        files = {}
+        inexact = set()
+        results = []
+        failed = False
+        for p, search, replace in edits:
+            fullp = self._writable(p)
+            if fullp is None:
+                results.append(f"Trying to write {p}: access denied")
+                failed = True
+                continue
+            if fullp not in files:
+                files[fullp] = self._load(fullp)
+            data, result, exact = self._apply_edit(p, files[fullp], search, replace)
+            results.append(result)
+            if data is None:
+                failed = True
+            else:
+                files[fullp] = data
+                if not exact:
+                    inexact.add(fullp)
+        if failed:
+            return [r if not r.startswith("OK") else "Not applied, another edit failed" for r in results]
+        for fullp, data in files.items():
+            logger(f"Updating {self._to_relative(fullp)}")
+            self._save(fullp, data)
+            self._remember(self._to_relative(fullp), fullp, data, fullp not in inexact)
+        self._index_paths([self._to_relative(fullp) for fullp in files])
+        return results
+
+    def read_files(self, paths):
+        rels = dict.fromkeys(os.path.normpath(p.lstrip("/")) for p in paths)
+        return {rel: self.read_file(rel) for rel in rels}
 
     def list_current_dir(self):
         return self._list_dir_entries(".")
@@ -99,14 +292,330 @@ class DirTree:
                 })
         return entries
 
-    def check_path(self, p: Path):
-        rel_start = len(self.cwd) + 1
-        rel = str(p)[rel_start:]
-        if rel in DIRTREE_EXCLUDE:
-            return False
-        parts = str(p).split("/")
-        for part in parts:
-            basename = part[part.rfind("/") + 1:]
-            if basename in DIRTREE_EXCLUDE_ANYWHERE:
-                return False
-        return True
+    def list_tree(self, relpath: str, max_depth: int, max_entries: int, globs: list[str]):
+        fullp = self._from_relative(relpath)
+        if fullp != self.cwd and not fullp.startswith(f"{self.cwd}/"):
+            logger(f"AI tried to list {relpath}, access denied", "warn")
+            return f"Trying to list {relpath}: access denied"
+        if not os.path.isdir(fullp):
+            logger(f"AI tried to list {relpath}, not a directory", "warn")
+            return f"Trying to list {relpath}: not a directory"
+        logger(f"Listing tree {relpath}")
+        rel = fullp[len(self.cwd) + 1:]
+        lines = []
+        self._scan_tree(fullp, rel, 0, max_depth, max_entries + 1, globs, lines)
+        if len(lines) > max_entries:
+            lines[max_entries:] = [f"... truncated at {max_entries} entries"]
+        return "\n".join(lines)
+
+    def _scan_tree(self, fullp: str, rel: str, depth: int, max_depth: int, max_entries: int, globs, lines):
+        try:
+            with os.scandir(fullp) as it:
+                entries = sorted(it, key=lambda e: e.name)
+        except OSError:
+            return
+        indent = "  " * depth
+        for entry in entries:
+            if len(lines) >= max_entries:
+                return
+            child_rel = f"{rel}/{entry.name}" if rel else entry.name
+            is_dir = entry.is_dir(follow_symlinks=False)
+            if self.ignore.is_ignored(child_rel, is_dir):
+                continue
+            if is_dir:
+                mark = len(lines)
+                lines.append(f"{indent}{entry.name}/")
+                if depth + 1 < max_depth:
+                    self._scan_tree(entry.path, child_rel, depth + 1, max_depth, max_entries, globs, lines)
+                    if globs and len(lines) == mark + 1:
+                        lines.pop()
+            elif not globs or any(fnmatch(child_rel, g) or fnmatch(entry.name, g) for g in globs):
+                lines.append(f"{indent}{entry.name}")
+
+    def _stamp(self, paths):
+        stamps = []
+        for path in paths:
+            try:
+                st = os.stat(path)
+                stamps.append(f"{st.st_mtime_ns}:{st.st_size}")
+            except OSError:
+                stamps.append("-")
+        return " ".join(stamps)
+
+    def _scan(self, known, cached, dirs):
+        # A directory's mtime only changes when entries are added, removed or renamed, so an unchanged one is
+        # not relisted and its known files are reused; a changed ignore file relists everything below it
+        files, subdirs = defaultdict(list), defaultdict(list)
+        for rel in known:
+            files[os.path.dirname(rel)].append(rel)
+        for rel in cached:
+            if rel:
+                subdirs[os.path.dirname(rel)].append(rel)
+        settled = time.time_ns() - DIRTREE_MTIME_SETTLE * 1_000_000_000
+        stack = [("", False)]
+        while stack:
+            rel, force = stack.pop()
+            fullp = f"{self.cwd}/{rel}" if rel else self.cwd
+            try:
+                st = os.stat(fullp)
+            except OSError:
+                continue
+            ignore = self._stamp([f"{fullp}/.gitignore"] + ([] if rel else self.ignore.rule_files))
+            row = cached.get(rel)
+            force = force or not row or row["ignore"] != ignore
+            if force or row["mtime"] != st.st_mtime_ns:
+                children, names = [], []
+                try:
+                    with os.scandir(fullp) as entries:
+                        for entry in entries:
+                            child = f"{rel}/{entry.name}" if rel else entry.name
+                            if entry.is_dir(follow_symlinks=False):
+                                if not self.ignore.is_ignored(child, True):
+                                    children.append(child)
+                            elif not entry.is_symlink() and not self.ignore.is_ignored(child, False):
+                                names.append(child)
+                except OSError:
+                    pass
+            else:
+                children, names = subdirs[rel], files[rel]
+            dirs[rel] = {"path": rel, "mtime": st.st_mtime_ns if st.st_mtime_ns < settled else None, "ignore": ignore}
+            stack.extend((child, force) for child in children)
+            yield from names
+
+    def _hash_file(self, fullp: str):
+        h = md5()
+        with open(fullp, "rb") as file:
+            while chunk := file.read(DIRTREE_HASH_CHUNK_SIZE):
+                h.update(chunk)
+        return h.hexdigest()
+
+    def _index_entry(self, rel: str, fullp: str, st):
+        entry = {"path": rel, "size": st.st_size, "mtime": st.st_mtime_ns, "inode": st.st_ino}
+        if st.st_size > SEARCH_MAX_FILE_BYTES:
+            entry["hash"] = self._hash_file(fullp)
+            return entry, ""
+        with open(fullp, "rb") as file:
+            data = file.read()
+        entry["hash"] = md5(data).hexdigest()
+        if self._binary_kind_of(data[:DIRTREE_BINARY_CHECK_BYTES]):
+            return entry, ""
+        return entry, data.decode(errors="replace")
+
+    def update_index(self):
+        self.ignore.refresh()
+        known = {row["path"]: row for row in self.db.get_files(self.cwd)}
+        if self.db.prune_code(SEARCH_INDEX_SLACK):
+            logger("Rebuilding the search index")
+        indexed = self.db.get_code_paths(self.cwd)
+        seen = set()
+        changed = []
+        contents = {}
+        cached = {row["path"]: row for row in self.db.get_dirs(self.cwd)}
+        dirs = {}
+        for rel in self._scan(known, cached, dirs):
+            fullp = f"{self.cwd}/{rel}"
+            try:
+                st = os.stat(fullp)
+                seen.add(rel)
+                row = known.get(rel)
+                if row and (row["size"], row["mtime"], row["inode"]) == (st.st_size, st.st_mtime_ns, st.st_ino) \
+                        and rel in indexed:
+                    continue
+                entry, contents[rel] = self._index_entry(rel, fullp, st)
+                changed.append(entry)
+            except OSError:
+                dirs[os.path.dirname(rel)]["mtime"] = None
+        removed = [p for p in known if p not in seen]
+        if changed or removed:
+            logger(f"Indexed {len(changed)} changed and {len(removed)} removed files")
+            # Short transactions, so deferred history writes aren't starved on a cold index
+            for i in range(0, max(len(changed), len(removed)), DIRTREE_INDEX_BATCH):
+                batch, gone = changed[i:i + DIRTREE_INDEX_BATCH], removed[i:i + DIRTREE_INDEX_BATCH]
+                with self.db.transaction():
+                    self.db.update_files(self.cwd, batch, gone)
+                    self.db.update_code(self.cwd, {e["path"]: contents[e["path"]] for e in batch}, gone)
+        self.db.update_dirs(self.cwd, [d for d in dirs.values() if d["path"] not in cached or
+                                       (d["mtime"], d["ignore"]) != tuple(cached[d["path"]])[1:]],
+                            [p for p in cached if p not in dirs])
+        added = [e["path"] for e in changed if e["path"] not in known]
+        modified = [e["path"] for e in changed if e["path"] in known and known[e["path"]]["hash"] != e["hash"]]
+        return added, modified, removed
+
+    def describe_changes(self, added, modified, removed):
+        changes = [("modified", p) for p in modified] + [("added", p) for p in added] + \
+                  [("removed", p) for p in removed]
+        if not changes:
+            return ""
+        lines = []
+        budget = CHANGES_MAX_BYTES
+        for kind, rel in changes[:CHANGES_MAX_PATHS]:
+            lines.append(f"{kind}: {rel}")
+            diff = self._change_diff(rel, min(budget, CHANGES_MAX_FILE_DIFF)) if kind == "modified" else None
+            if diff:
+                lines.append(diff)
+                budget -= len(diff)
+        if len(changes) > CHANGES_MAX_PATHS:
+            lines.append(f"... and {len(changes) - CHANGES_MAX_PATHS} more")
+        logger(f"Reporting {len(changes)} files changed since the last prompt")
+        return "Files changed outside this conversation since your last turn:\n" + "\n".join(lines)
+
+    def manifest(self):
+        rows = sorted((row["path"], row["size"], row["hash"]) for row in self.db.get_files(self.cwd))
+        fingerprint = md5("\n".join(f"{p}\0{h}" for p, _, h in rows).encode()).hexdigest()
+        files = self._manifest_files({p for p, _, _ in rows})
+        manifest = self.db.get_manifest(self.cwd, fingerprint)
+        if manifest is None:
+            tree = {}
+            for path, size, _ in rows:
+                node = tree
+                *dirs, name = path.split("/")
+                for d in dirs:
+                    node = node.setdefault(f"{d}/", {})
+                node[name] = size
+            lines = []
+            self._manifest_tree(tree, 0, lines)
+            if len(lines) > MANIFEST_MAX_ENTRIES:
+                lines[MANIFEST_MAX_ENTRIES:] = [f"... truncated at {MANIFEST_MAX_ENTRIES} entries"]
+            header = "Workspace manifest, file sizes in bytes"
+            if files:
+                header += ", followed by the current contents of key files, no need to read them again"
+            manifest = "\n".join([f"{header}:"] + lines + [f"==> {rel} <==\n{data}" for rel, data in files])
+            self.db.set_manifest(self.cwd, fingerprint, manifest)
+        for rel, data in files:
+            st = os.stat(f"{self.cwd}/{rel}")
+            self.db.set_read(self.cwd, rel, st.st_mtime_ns, st.st_size, md5(data.encode()).hexdigest(), data)
+        logger("Attaching workspace manifest")
+        return manifest
+
+    def _manifest_tree(self, node, depth, lines):
+        indent = "  " * depth
+        for name in sorted(node):
+            if len(lines) > MANIFEST_MAX_ENTRIES:
+                return
+            child = node[name]
+            if not isinstance(child, dict):
+                lines.append(f"{indent}{name} {child}")
+            elif depth + 1 < MANIFEST_MAX_DEPTH:
+                lines.append(f"{indent}{name}")
+                self._manifest_tree(child, depth + 1, lines)
+            else:
+                sizes = []
+                stack = [child]
+                while stack:
+                    for value in stack.pop().values():
+                        if isinstance(value, dict):
+                            stack.append(value)
+                        else:
+                            sizes.append(value)
+                lines.append(f"{indent}{name} ({len(sizes)} files, {sum(sizes)} bytes)")
+
+    def _manifest_files(self, paths):
+        files = []
+        budget = MANIFEST_MAX_BYTES
+        for rel in MANIFEST_FILES:
+            fullp = f"{self.cwd}/{rel}"
+            if rel not in paths or self._binary_kind(fullp):
+                continue
+            with open(fullp, "r", errors="replace") as file:
+                data = file.read(MANIFEST_FILE_MAX_BYTES + 1)
+            if len(data) <= min(MANIFEST_FILE_MAX_BYTES, budget):
+                files.append((rel, data))
+                budget -= len(data)
+        return files
+
+    def _change_diff(self, rel: str, limit: int):
+        cached = self.db.get_read(self.cwd, rel)
+        fullp = f"{self.cwd}/{rel}"
+        if not cached or self._binary_kind(fullp):
+            return None
+        st = os.stat(fullp)
+        with open(fullp, "r", errors="replace") as file:
+            data = file.read()
+        diff = "".join(unified_diff(cached["content"].splitlines(keepends=True), data.splitlines(keepends=True),
+                                    f"a/{rel}", f"b/{rel}"))
+        if not diff or len(diff) > limit:
+            return None
+        self.db.set_read(self.cwd, rel, st.st_mtime_ns, st.st_size, md5(data.encode()).hexdigest(), data)
+        return diff.rstrip("\n")
+
+    def _index_paths(self, rels):
+        changed = []
+        contents = {}
+        for rel in rels:
+            fullp = f"{self.cwd}/{rel}"
+            if self.ignore.is_ignored(rel, False) or os.path.islink(fullp) or not os.path.isfile(fullp):
+                continue
+            entry, contents[rel] = self._index_entry(rel, fullp, os.stat(fullp))
+            changed.append(entry)
+        with self.db.lock, self.db.transaction():
+            self.db.update_files(self.cwd, changed, [])
+            self.db.update_code(self.cwd, contents, [])
+
+    def _search_literal(self, pattern: str):
+        runs = []
+        run = ""
+        depth = 0
+        i = 0
+        while i < len(pattern):
+            c = pattern[i]
+            if c == "|" and depth == 0:
+                return None
+            if c in "?*{":
+                run = run[:-1]
+            if c in ".^$*+?{}[]()|\\":
+                runs.append(run)
+                run = ""
+                if c == "\\":
+                    i += 1
+                elif c in "[{":
+                    end = pattern.find("]" if c == "[" else "}", i + 2)
+                    i = end if end != -1 else i
+                elif c == "(":
+                    depth += 1
+                elif c == ")":
+                    depth -= 1
+            elif depth == 0:
+                run += c
+            i += 1
+        runs.append(run)
+        return max(runs, key=len)
+
+    def _searchable_text(self, fullp: str):
+        try:
+            if os.path.getsize(fullp) > SEARCH_MAX_FILE_BYTES:
+                return None
+            with open(fullp, "rb") as file:
+                data = file.read()
+        except OSError:
+            return None
+        return None if self._binary_kind_of(data[:DIRTREE_BINARY_CHECK_BYTES]) else data.decode(errors="replace")
+
+    def search_code(self, query: str, regex: bool, glob, ignore_case: bool):
+        logger(f"Searching for {query}")
+        flags = re.IGNORECASE if ignore_case else 0
+        try:
+            matcher = re.compile(query if regex else re.escape(query), flags)
+        except re.error as e:
+            logger(f"AI tried to search for {query}, {e}", "warn")
+            return f"Trying to search for {query}: {e}"
+        literal = self._search_literal(query) if regex else query
+        keep = (lambda rel: fnmatch(rel, glob) or fnmatch(os.path.basename(rel), glob)) if glob else None
+        paths = self.db.search_code(self.cwd, literal, SEARCH_MAX_FILES, keep)
+        results = []
+        files = 0
+        for rel in paths:
+            data = self._searchable_text(f"{self.cwd}/{rel}")
+            matches = [(n, line) for n, line in enumerate(data.splitlines(), 1) if matcher.search(line)] if data else []
+            if matches:
+                files += 1
+                results.extend(f"{rel}:{n}: {line.strip()[:SEARCH_MAX_LINE]}" for n, line in matches)
+        if not results:
+            return f"No matches for {query}"
+        header = f"{len(results)} matches in {files} files"
+        if len(results) > SEARCH_MAX_RESULTS:
+            header += f", showing first {SEARCH_MAX_RESULTS}"
+        return "\n".join([header] + results[:SEARCH_MAX_RESULTS])
+
+    def check_path(self, p: Path, is_dir=None):
+        rel = str(p)[len(self.cwd) + 1:]
+        return not self.ignore.is_ignored(rel, p.is_dir() if is_dir is None else is_dir)
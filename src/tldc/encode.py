@@ -0,0 +1,23 @@
+import json
+
+def _entries(result):
+    return "\n".join(e["path"] + ("/" if e["is_dir"] else "") for e in result) or "(empty directory)"
+
+def _files(result):
+    return "\n".join(f"==> {path} <==\n{content}" for path, content in result.items())
+
+def _edits(result):
+    return "\n".join(f"{n}: {r}" for n, r in enumerate(result, 1))
+
+_encoders = {
+    "list_current_dir": _entries,
+    "list_dir": _entries,
+    "read_files": _files,
+    "write_files": _edits,
+}
+
+def encode_result(function_name, result) -> str:
+    if isinstance(result, str):
+        return result
+    encoder = _encoders.get(function_name)
+    return encoder(result) if encoder else json.dumps(result)
@@ -0,0 +1,74 @@
+import contextvars
+import queue
+import threading
+
+_scope = contextvars.ContextVar("hedge_scope", default=None)
+
+class _Scope:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.callbacks = []
+        self.state = None
+
+    def add(self, callback):
+        with self.lock:
+            if self.state is None:
+                self.callbacks.append(callback)
+                return
+            cancelled = self.state == "cancelled"
+        if cancelled:
+            callback()
+
+    def finish(self, cancel=False):
+        with self.lock:
+            if self.state is not None:
+                return
+            self.state = "cancelled" if cancel else "done"
+            callbacks, self.callbacks = self.callbacks, []
+        if cancel:
+            for callback in callbacks:
+                try:
+                    callback()
+                except Exception:
+                    pass
+
+def on_cancel(callback):
+    scope = _scope.get()
+    if scope is not None:
+        scope.add(callback)
+
+def race(calls, delay):
+    results = queue.Queue()
+    errors = []
+    scopes = []
+
+    def run(index):
+        _scope.set(scopes[index])
+        try:
+            results.put((index, calls[index](), None))
+        except Exception as e:
+            results.put((index, None, e))
+        finally:
+            scopes[index].finish()
+
+    def start():
+        scopes.append(_Scope())
+        threading.Thread(target=contextvars.copy_context().run, args=(run, len(scopes) - 1), daemon=True).start()
+
+    start()
+    while True:
+        try:
+            index, result, error = results.get(timeout=delay if len(scopes) < len(calls) else None)
+        except queue.Empty:
+            start()
+            continue
+        if error is None:
+            for n, scope in enumerate(scopes):
+                if n != index:
+                    scope.finish(cancel=True)
+            return index, result, len(scopes)
+        errors.append(error)
+        if len(scopes) < len(calls):
+            start()
+        elif len(errors) == len(scopes):
+            raise errors[0]
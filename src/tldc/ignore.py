@@ -0,0 +1,136 @@
+import os
+import re
+from .constants import DIRTREE_IGNORE
+
+def _translate(pattern: str) -> str:
+    i = 0
+    n = len(pattern)
+    out = []
+    while i < n:
+        c = pattern[i]
+        if c == "*":
+            if pattern[i:i + 3] == "**/":
+                out.append("(?:.*/)?")
+                i += 3
+                continue
+            if pattern[i:i + 2] == "**":
+                out.append(".*")
+                i += 2
+                continue
+            out.append("[^/]*")
+        elif c == "?":
+            out.append("[^/]")
+        elif c == "[":
+            end = pattern.find("]", i + 2)
+            if end == -1:
+                out.append(re.escape(c))
+            else:
+                body = pattern[i + 1:end].replace("\\", "\\\\")
+                if body[0] in "!^":
+                    body = "^" + body[1:]
+                out.append(f"[{body}]")
+                i = end
+        elif c == "\\" and i + 1 < n:
+            i += 1
+            out.append(re.escape(pattern[i]))
+        else:
+            out.append(re.escape(c))
+        i += 1
+    return "".join(out)
+
+def compile_rule(line: str):
+    if line.endswith("\n"):
+        line = line[:-1]
+    if not line.endswith("\\ "):
+        line = line.rstrip()
+    if not line or line.startswith("#"):
+        return None
+    negate = line.startswith("!")
+    if negate or line[:2] in ("\\#", "\\!"):
+        line = line[1:]
+    dir_only = line.endswith("/")
+    line = line.rstrip("/")
+    if not line:
+        return None
+    anchored = "/" in line
+    regex = _translate(line.lstrip("/"))
+    if not anchored:
+        regex = "(?:.*/)?" + regex
+    return re.compile(regex + r"\Z"), negate, dir_only
+
+def load_rules(path: str):
+    try:
+        with open(path, "r", errors="replace") as file:
+            return [rule for rule in map(compile_rule, file) if rule]
+    except OSError:
+        return []
+
+def _git_root(cwd: str):
+    path = cwd
+    while True:
+        if os.path.exists(os.path.join(path, ".git")):
+            return path
+        parent = os.path.dirname(path)
+        if parent == path:
+            return None
+        path = parent
+
+class IgnoreMatcher:
+    def __init__(self, cwd: str):
+        self.cwd = cwd
+        self.refresh()
+
+    def refresh(self):
+        self._dirs = {}
+        self._chains = {}
+        defaults = [(self.cwd, [rule for rule in map(compile_rule, DIRTREE_IGNORE) if rule])]
+        self.rule_files = [os.path.join(self.cwd, ".tldcignore")]
+        root = _git_root(self.cwd)
+        if root:
+            self.rule_files.append(os.path.join(root, ".git", "info", "exclude"))
+            defaults.append((root, load_rules(self.rule_files[-1])))
+            path = root
+            parts = os.path.relpath(self.cwd, root).split(os.sep)
+            for part in [""] + [p for p in parts if p != "."]:
+                path = os.path.join(path, part) if part else path
+                if path != self.cwd:
+                    self.rule_files.append(os.path.join(path, ".gitignore"))
+                    defaults.append((path, load_rules(self.rule_files[-1])))
+        self._top = defaults
+        self._last = [(self.cwd, load_rules(self.rule_files[0]))]
+
+    def _chain(self, dir_rel: str):
+        chain = self._chains.get(dir_rel)
+        if chain is None:
+            if dir_rel:
+                parent = self._chain(os.path.dirname(dir_rel))
+                base = f"{self.cwd}/{dir_rel}"
+            else:
+                parent = self._top
+                base = self.cwd
+            chain = parent + [(base, load_rules(f"{base}/.gitignore"))]
+            self._chains[dir_rel] = chain
+        return chain
+
+    def _match(self, rel: str, is_dir: bool):
+        fullp = f"{self.cwd}/{rel}"
+        ignored = False
+        for base, rules in self._chain(os.path.dirname(rel)) + self._last:
+            sub = fullp[len(base) + 1:]
+            for regex, negate, dir_only in rules:
+                if (is_dir or not dir_only) and regex.match(sub):
+                    ignored = not negate
+        return ignored
+
+    def is_ignored(self, rel: str, is_dir: bool) -> bool:
+        if not rel or rel == ".":
+            return False
+        parent = os.path.dirname(rel)
+        if parent and self.is_ignored(parent, True):
+            return True
+        if is_dir:
+            ignored = self._dirs.get(rel)
+            if ignored is None:
+                ignored = self._dirs[rel] = self._match(rel, True)
+            return ignored
+        return self._match(rel, False)
@@ -1,10 +1,17 @@
 #!/usr/bin/env python
+import atexit
+import os
 import sys
+import time
 import click
+from . import daemon as _daemon
+from .batch import Batch, load_manifest
+from .constants import DAEMON_LOCAL_COMMANDS, CHAT_HISTORY_FILE, CHAT_HISTORY_LENGTH, BATCH_WORKERS
 from .context import Context
 from .clean_click import CleanGroup
+from .db import config_dir
 
-def app_close(msg=None):
+def app_close(context, msg=None):
     if msg:
         print(msg)
     context.close()
@@ -13,70 +20,269 @@ def app_close(msg=None):
 @click.group(cls=CleanGroup, invoke_without_command=True)
 @click.pass_context
 def main(ctx):
-    global context
-    context = Context()
+    if ctx.obj is None:
+        ctx.obj = Context()
     if ctx.invoked_subcommand is None:
         click.echo(ctx.get_help())
-        app_close()
+        app_close(ctx.obj)
 
 @main.group(cls=CleanGroup)
 def models():
     pass
 
 @models.command()
-def list():
+@click.pass_obj
+def list(context):
     """List available models"""
     models = context.get_models()
     if models:
         print(f"{'Name':<32}{'Provider':<16}Settings")
         for model in models:
             print(f"{model['model_name']:<32}{model['provider']:<16}{model['settings']}")
-    app_close()
+    app_close(context)
 
 @models.command()
 @click.argument("model_name")
 @click.argument("provider")
 @click.argument("settings")
-def add(model_name, provider, settings):
+@click.pass_obj
+def add(context, model_name, provider, settings):
     """Add a model"""
     context.add_model(model_name, provider, settings)
-    app_close("Done.")
+    app_close(context, "Done.")
 
 @models.command()
 @click.argument("model_name")
-def delete(model_name):
+@click.pass_obj
+def delete(context, model_name):
     """Delete a model"""
     context.del_model(model_name)
-    app_close("Done.")
+    app_close(context, "Done.")
 
 @models.command()
-def get():
+@click.pass_obj
+def get(context):
     """Get active model"""
     model = context.get_active_model()
     print(f"Active model: {model}")
-    app_close()
+    app_close(context)
 
 @models.command()
 @click.argument("model_name")
-def set(model_name):
+@click.pass_obj
+def set(context, model_name):
     """Set active model"""
     context.set_active_model(model_name)
-    app_close("Done.")
+    app_close(context, "Done.")
 
 @main.command()
-def prompt():
+@click.option("--stream", is_flag=True)
+@click.pass_obj
+def prompt(context, stream):
     """Enter prompt"""
     print("Press ctrl-d to finish.")
     prompt = sys.stdin.read()
-    response = context.prompt(prompt)
-    print(f"Response:\n{response}")
-    app_close()
+    response = context.prompt(prompt, stream)
+    if not stream:
+        print(f"Response:\n{response}")
+    app_close(context)
+
+def _load_history():
+    try:
+        import readline
+    except ImportError:
+        return
+    path = os.path.join(config_dir(), CHAT_HISTORY_FILE)
+    try:
+        readline.read_history_file(path)
+    except OSError:
+        pass
+    readline.set_history_length(CHAT_HISTORY_LENGTH)
+    atexit.register(readline.write_history_file, path)
+
+def _read_prompt():
+    line = input("> ")
+    while line.endswith("\\"):
+        line = line[:-1] + "\n" + input("... ")
+    return line
+
+@main.command()
+@click.option("--stream", is_flag=True)
+@click.pass_obj
+def chat(context, stream):
+    """Start an interactive chat"""
+    _load_history()
+    context.start_session()
+    print("End lines with \\ to continue them. Commands: /compact, /reset, /exit (or ctrl-d).")
+    while True:
+        try:
+            prompt = _read_prompt()
+        except EOFError:
+            print()
+            break
+        except KeyboardInterrupt:
+            print()
+            continue
+        command = prompt.strip()
+        if not command:
+            continue
+        if command in ("/exit", "/quit"):
+            break
+        try:
+            if command == "/compact":
+                print("Done." if context.compact() else "Nothing to compact.")
+            elif command == "/reset":
+                context.reset()
+                print("Done.")
+            else:
+                response = context.prompt(prompt, stream)
+                if not stream:
+                    print(response)
+        except SystemExit:
+            pass
+    app_close(context)
 
 @main.command()
-def reset():
+@click.argument("manifest", type=click.File("r"))
+@click.argument("results", type=click.File("w"))
+@click.option("--workers", default=BATCH_WORKERS, show_default=True)
+@click.option("--timeout", type=float, help="Per-job timeout in seconds.")
+@click.option("--model-concurrency", type=int, help="Concurrent jobs per model.")
+@click.pass_obj
+def batch(context, manifest, results, workers, timeout, model_concurrency):
+    """Run a JSONL manifest of prompts"""
+    jobs = load_manifest(manifest)
+    done = Batch(context, workers, timeout, model_concurrency).run(jobs, results)
+    ok = sum(r["status"] == "ok" for r in done)
+    app_close(context, f"{ok} of {len(jobs)} jobs succeeded.")
+
+@main.group(cls=CleanGroup)
+def db():
+    pass
+
+@db.command()
+@click.pass_obj
+def maintain(context):
+    """Compact the database"""
+    context.maintain()
+    app_close(context, "Done.")
+
+@main.command()
+@click.pass_obj
+def compact(context):
+    """Compact current context"""
+    app_close(context, "Done." if context.compact() else "Nothing to compact.")
+
+@main.command()
+@click.option("--all", "all_contexts", is_flag=True)
+@click.pass_obj
+def stats(context, all_contexts):
+    """Show latency and token statistics"""
+    summary, slowest, savings = context.stats(all_contexts)
+    print(f"{'Kind':<10}{'Name':<32}{'Calls':>7}{'p50':>9}{'p90':>9}{'p99':>9}{'Max':>9}"
+          f"{'Bytes out':>12}{'Bytes in':>12}{'Tokens in':>11}{'Tokens out':>11}")
+    for row in summary:
+        if row["context"] and all_contexts:
+            print(f"[{row['context']}]")
+        print(f"{row['kind']:<10}{row['name']:<32}{row['calls']:>7}{row['p50']:>9.3f}{row['p90']:>9.3f}"
+              f"{row['p99']:>9.3f}{row['max']:>9.3f}{row['bytes_out']:>12}{row['bytes_in']:>12}"
+              f"{row['prompt_tokens']:>11}{row['completion_tokens']:>11}")
+    if slowest:
+        print("\nSlowest tool calls:")
+        for row in slowest:
+            print(f"{row['duration']:>9.3f}  {row['name']:<24}{row['context']}")
+    if savings["json_bytes"]:
+        print(f"\nTool results: {savings['bytes']} bytes (~{savings['tokens']} tokens), "
+              f"{savings['json_bytes']} bytes (~{savings['json_tokens']} tokens) as JSON, "
+              f"{100 - 100 * savings['bytes'] / savings['json_bytes']:.1f}% saved")
+    app_close(context)
+
+@main.command()
+@click.pass_obj
+def reset(context):
     """Reset current context"""
     context.reset()
-    app_close("Done.")
+    app_close(context, "Done.")
+
+def _retention(policy):
+    if policy is None:
+        return "-"
+    parts = []
+    if policy["max_age"] is not None:
+        parts.append(f"{policy['max_age']:g}d")
+    if policy["max_bytes"] is not None:
+        parts.append(f"{policy['max_bytes']}B")
+    return "/".join(parts)
+
+@main.group(cls=CleanGroup)
+def history():
+    pass
+
+@history.command()
+@click.option("--all", "all_contexts", is_flag=True)
+@click.pass_obj
+def show(context, all_contexts):
+    """Show stored history per context"""
+    print(f"{'Messages':>9}{'Turns':>7}{'Size':>12}{'Stored':>12}  {'Oldest':<18}{'Newest':<18}{'Retention':<16}"
+          f"Context")
+    for row, policy in context.history_stats(all_contexts):
+        oldest, newest = (time.strftime("%Y-%m-%d %H:%M", time.localtime(row[key])) if row[key] else "-"
+                          for key in ("oldest", "newest"))
+        print(f"{row['messages']:>9}{row['turns']:>7}{row['size']:>12}{row['stored']:>12}  {oldest:<18}{newest:<18}"
+              f"{_retention(policy):<16}{row['context']}")
+    app_close(context)
+
+@history.command()
+@click.option("--all", "all_contexts", is_flag=True)
+@click.option("--max-age", type=click.FloatRange(min=0), help="Drop turns older than this many days.")
+@click.option("--max-bytes", type=click.IntRange(min=0), help="Keep only the newest turns within this size.")
+@click.pass_obj
+def prune(context, all_contexts, max_age, max_bytes):
+    """Prune and compress history (uses the retention policy if no limits are given)"""
+    deleted, packed = context.prune_history(all_contexts, max_age, max_bytes)
+    app_close(context, f"Deleted {deleted} messages, compressed {packed}.")
+
+@history.command()
+@click.option("--all", "all_contexts", is_flag=True, help="Set the default policy for all contexts.")
+@click.option("--max-age", type=click.FloatRange(min=0), help="Drop turns older than this many days.")
+@click.option("--max-bytes", type=click.IntRange(min=0), help="Keep only the newest turns within this size.")
+@click.pass_obj
+def retain(context, all_contexts, max_age, max_bytes):
+    """Set the history retention policy (no limits clears it)"""
+    context.set_retention(all_contexts, max_age, max_bytes)
+    app_close(context, "Done.")
+
+@main.group(cls=CleanGroup)
+def daemon():
+    pass
+
+@daemon.command()
+@click.pass_obj
+def start(context):
+    """Run the daemon in the foreground"""
+    context.close()
+    _daemon.serve()
+    sys.exit(0)
+
+@daemon.command()
+@click.pass_obj
+def stop(context):
+    """Stop the running daemon"""
+    app_close(context, "Done." if _daemon.stop() else "Daemon not running.")
+
+@daemon.command()
+@click.pass_obj
+def status(context):
+    """Show daemon status"""
+    app_close(context, f"Running on {_daemon.socket_path()}" if _daemon.ping() else "Daemon not running.")
+
+def run():
+    argv = sys.argv[1:]
+    if not argv or argv[0] not in DAEMON_LOCAL_COMMANDS:
+        code = _daemon.forward(argv, os.getcwd())
+        if code is not None:
+            sys.exit(code)
+    main()
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    run()
\ No newline at end of file
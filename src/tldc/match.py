@@ -0,0 +1,124 @@
+from bisect import bisect_right
+from collections import defaultdict
+from difflib import SequenceMatcher
+from .constants import MATCH_FUZZY_THRESHOLD
+
+class LineIndex:
+    def __init__(self, data: str):
+        self.data = data
+        self.lines = data.splitlines(keepends=True)
+        self.offsets = [0]
+        for line in self.lines:
+            self.offsets.append(self.offsets[-1] + len(line))
+        self.stripped = [line.strip() for line in self.lines]
+        self.positions = defaultdict(list)
+        for n, line in enumerate(self.stripped):
+            self.positions[line].append(n)
+
+    def line_at(self, offset: int) -> int:
+        return bisect_right(self.offsets, offset) - 1
+
+class Match:
+    def __init__(self, index: LineIndex, start: int, end: int, kind: str, ratio: float = 1.0):
+        self.start = start
+        self.end = end
+        self.kind = kind
+        self.ratio = ratio
+        self.first = index.line_at(start) + 1
+        self.last = max(self.first, index.line_at(max(start, end - 1)) + 1)
+
+    def describe(self) -> str:
+        lines = f"line {self.first}" if self.first == self.last else f"lines {self.first}-{self.last}"
+        if self.kind == "normalized":
+            return f"{lines}, matched ignoring whitespace"
+        if self.kind == "fuzzy":
+            return f"{lines}, fuzzy match {self.ratio:.0%} similar"
+        return lines
+
+def _indent(line: str) -> str:
+    return line[:len(line) - len(line.lstrip())]
+
+def _search_lines(search: str):
+    lines = search.splitlines()
+    while lines and not lines[0].strip():
+        lines.pop(0)
+    while lines and not lines[-1].strip():
+        lines.pop()
+    return lines
+
+def _exact(index: LineIndex, search: str):
+    for candidate in dict.fromkeys((search, search.replace(r'\"', '"'))):
+        count = index.data.count(candidate)
+        if count == 1:
+            start = index.data.find(candidate)
+            return Match(index, start, start + len(candidate), "exact")
+        if count > 1:
+            lines = []
+            start = index.data.find(candidate)
+            while start != -1 and len(lines) < 5:
+                lines.append(str(index.line_at(start) + 1))
+                start = index.data.find(candidate, start + 1)
+            raise ValueError(f"search matches {count} times (lines {', '.join(lines)}), include more context")
+    return None
+
+def _normalized(index: LineIndex, lines):
+    wanted = [line.strip() for line in lines]
+    found = [n for n in index.positions.get(wanted[0], ())
+             if index.stripped[n:n + len(wanted)] == wanted]
+    if len(found) > 1:
+        raise ValueError(f"search matches {len(found)} times ignoring whitespace "
+                         f"(lines {', '.join(str(n + 1) for n in found[:5])}), include more context")
+    return found[0] if found else None
+
+def _fuzzy(index: LineIndex, lines):
+    wanted = [line.strip() for line in lines]
+    size = len(wanted)
+    starts = set(index.positions.get(wanted[0], ()))
+    starts.update(n - size + 1 for n in index.positions.get(wanted[-1], ()))
+    starts = [n for n in starts if 0 <= n <= len(index.lines) - size]
+    text = "\n".join(wanted)
+    scored = []
+    for start in starts:
+        matcher = SequenceMatcher(None, text, "\n".join(index.stripped[start:start + size]), autojunk=False)
+        if matcher.real_quick_ratio() >= MATCH_FUZZY_THRESHOLD and matcher.quick_ratio() >= MATCH_FUZZY_THRESHOLD:
+            scored.append((matcher.ratio(), start))
+    scored.sort(reverse=True)
+    if not scored or scored[0][0] < MATCH_FUZZY_THRESHOLD:
+        return None, None
+    if len(scored) > 1 and scored[1][0] == scored[0][0]:
+        raise ValueError(f"search fuzzily matches lines {scored[0][1] + 1} and {scored[1][1] + 1} equally, "
+                         f"include more context")
+    return scored[0][1], scored[0][0]
+
+def _reindent(replace: str, search_line: str, file_line: str, newline: str) -> str:
+    have, want = _indent(search_line), _indent(file_line)
+    lines = replace.splitlines()
+    if want.startswith(have):
+        lines = [want[len(have):] + line if line.strip() else line for line in lines]
+    elif have.startswith(want):
+        extra = have[len(want):]
+        lines = [line[len(extra):] if line.startswith(extra) else line for line in lines]
+    return "".join(line + newline for line in lines)
+
+def apply_edit(index: LineIndex, search: str, replace: str):
+    match = _exact(index, search)
+    if match:
+        return index.data[:match.start] + replace + index.data[match.end:], match
+    lines = _search_lines(search)
+    if not lines:
+        raise ValueError("search not found")
+    kind, ratio = "normalized", 1.0
+    start = _normalized(index, lines)
+    if start is None:
+        kind = "fuzzy"
+        start, ratio = _fuzzy(index, lines)
+    if start is None:
+        raise ValueError("search not found, reread the file and retry with its exact text")
+    end = start + len(lines)
+    last = index.lines[end - 1]
+    newline = "\r\n" if index.lines[start].endswith("\r\n") else "\n"
+    replacement = _reindent(replace, lines[0], index.lines[start], newline)
+    if not last.endswith("\n"):
+        replacement = replacement[:-len(newline)] if replacement else replacement
+    match = Match(index, index.offsets[start], index.offsets[end], kind, ratio)
+    return index.data[:match.start] + replacement + index.data[match.end:], match
@@ -1,79 +1,215 @@
 import json
+import socket
+import threading
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from urllib3.exceptions import ReadTimeoutError
+from urllib3.util.retry import Retry
 from ..assistant import Assistant, register
-from ..constants import SYSTEM_PROMPT
+from ..compact import is_summary, transcript
+from ..constants import SYSTEM_PROMPT, COMPACT_PROMPT
+from ..constants import OLLAMA_TIMEOUT, OLLAMA_RETRIES, OLLAMA_BACKOFF, OLLAMA_POOL_SIZE
+from ..hedge import on_cancel
 from ..logger import logger
 
+_sessions = {}
+_sessions_lock = threading.Lock()
+
+def _shutdown(sock):
+    try:
+        sock.shutdown(socket.SHUT_RDWR)
+    except OSError:
+        pass
+
+class _Cancellable:
+    # Lets a lost hedge race drop its connection, so Ollama stops generating for it
+    def getresponse(self, *args, **kwargs):
+        if self.sock is not None:
+            on_cancel(lambda sock=self.sock: _shutdown(sock))
+        return super().getresponse(*args, **kwargs)
+
+class _Connection(_Cancellable, HTTPConnection):
+    pass
+
+class _HTTPSConnection(_Cancellable, HTTPSConnection):
+    pass
+
+class _Pool(HTTPConnectionPool):
+    ConnectionCls = _Connection
+
+class _HTTPSPool(HTTPSConnectionPool):
+    ConnectionCls = _HTTPSConnection
+
+def _session(retries, backoff, pool_size):
+    with _sessions_lock:
+        key = (retries, backoff, pool_size)
+        if key not in _sessions:
+            # Generation POSTs aren't idempotent, only retry when the request never reached the model
+            retry = Retry(total=retries, connect=retries, read=0, other=0, status=retries, backoff_factor=backoff,
+                          status_forcelist=[502, 503, 504], allowed_methods=None)
+            adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+            adapter.poolmanager.pool_classes_by_scheme = {"http": _Pool, "https": _HTTPSPool}
+            session = requests.Session()
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+            _sessions[key] = session
+        return _sessions[key]
+
 class Ollama(Assistant):
     def __init__(self, model, provider, settings, db, dirtree):
         super().__init__(model, provider, settings, db, dirtree)
-        self.url = json.loads(settings)["url"]
+        self.url = self.settings["url"]
+        self.timeout = self.settings.get("timeout", OLLAMA_TIMEOUT)
+        self.keep_alive = self.settings.get("keep_alive")
+        self.session = _session(self.settings.get("retries", OLLAMA_RETRIES),
+                                self.settings.get("backoff", OLLAMA_BACKOFF),
+                                self.settings.get("pool_size", OLLAMA_POOL_SIZE))
+
+    def _post(self, data, stream, record):
+        body = json.dumps(data).encode()
+        record["bytes_out"] += len(body)
+        request = json.dumps({k: v for k, v in data.items() if k not in ("stream", "keep_alive")},
+                             sort_keys=True).encode()
+        response_data, cached = self._cached(request, lambda: self._send(body, stream, record),
+                                             lambda r: json.dumps(r).encode(), json.loads)
+        if cached is not None:
+            record["bytes_in"] += len(cached)
+            record["cached"] = True
+            if stream and response_data["message"].get("content"):
+                print(response_data["message"]["content"])
+        record["prompt_tokens"] = response_data.get("prompt_eval_count")
+        record["completion_tokens"] = response_data.get("eval_count")
+        return response_data
 
-    def _call_ollama(self, messages, tools=None):
+    def _send(self, body, stream, record):
+        remaining = self._remaining()
+        response = self.session.post(f"{self.url}/api/chat", data=body, headers={"Content-Type": "application/json"},
+                                     stream=stream, timeout=min(self.timeout, remaining or self.timeout))
+        response.raise_for_status()
+        if stream:
+            return self._read_stream(response, record)
+        record["bytes_in"] += len(response.content)
+        return response.json()
+
+    def _read_stream(self, response, record):
+        content = []
+        tool_calls = []
+        data = {}
+        for line in response.iter_lines():
+            if not line:
+                continue
+            record["bytes_in"] += len(line)
+            data = json.loads(line)
+            if "error" in data:
+                raise RuntimeError(data["error"])
+            message = data.get("message", {})
+            if message.get("content"):
+                print(message["content"], end="", flush=True)
+                content.append(message["content"])
+            for tool_call in message.get("tool_calls", []):
+                logger(f"Calling {tool_call['function']['name']}")
+                tool_calls.append(tool_call)
+        if content:
+            print()
+        data["message"] = {"role": "assistant", "content": "".join(content)}
+        if tool_calls:
+            data["message"]["tool_calls"] = tool_calls
+        return data
+
+    def _request(self, messages, tools, stream):
         data = {
             "model": self.model,
             "messages": messages,
-            "stream": False
+            "stream": stream
         }
+        if self.keep_alive is not None:
+            data["keep_alive"] = self.keep_alive
+        stats = {"bytes_in": 0, "bytes_out": 0}
         if tools:
-            data["tools"] = tools
-        try:
-            response = requests.post(f"{self.url}/api/chat", json=data)
-            response.raise_for_status()
-            return response.json()
-        except requests.HTTPError as e:
-            if tools and response.status_code == 400:
-                # Retry without tools
-                data_no_tools = data.copy()
-                del data_no_tools['tools']
-                response = requests.post(f"{self.url}/api/chat", json=data_no_tools)
-                response.raise_for_status()
-                return response.json()
-            else:
-                raise
-
-    def prompt(self, prompt):
+            try:
+                return self, self._post({**data, "tools": tools}, stream, stats), stats, False
+            except requests.HTTPError as e:
+                if e.response.status_code != 400 or "does not support tools" not in e.response.text:
+                    raise
+        # Retry without tools
+        return self, self._post(data, stream, stats), stats, bool(tools)
+
+    def _transient(self, e):
+        if isinstance(e, requests.HTTPError):
+            return e.response.status_code in (429, 500, 502, 503, 504)
+        # A read timeout means the server may still be generating, requests wraps mid-stream ones as ConnectionError
+        reason = e.args[0] if isinstance(e, requests.ConnectionError) and e.args else None
+        if isinstance(e, requests.ReadTimeout) or isinstance(getattr(reason, "reason", reason), ReadTimeoutError):
+            return False
+        return isinstance(e, (requests.ConnectionError, requests.exceptions.RetryError))
+
+    def _call_ollama(self, messages, tools=None, stream=False):
+        with self.telemetry.span("model", self.model, stream=stream) as record:
+            messages = messages[:]
+            assistant, response_data, stats, no_tools = self._call_model(
+                lambda a: a._request(messages, tools, stream), record, stream)
+            if stats.pop("cached", False):
+                record["meta"]["cached"] = True
+            record.update(stats)
+            if no_tools:
+                record["meta"]["retry"] = "no tools"
+                logger(f"Model {assistant.model} does not support tools, disabling them")
+                assistant.settings["tools"] = False
+                assistant.save_settings()
+            return response_data
+
+    def prompt(self, prompt, stream=False):
         # Load history
-        messages = []
-        for row in self.db.get_history(self.dirtree.cwd):
-            messages.append(json.loads(row['message']))
-        # If no history, add system prompt
-        if not messages:
-            messages.append({"role": "system", "content": SYSTEM_PROMPT})
+        messages = self.get_messages()
+        # Add system prompt, older versions stored it in history, replace it but keep compaction summaries
+        while messages and messages[0]["role"] == "system" and not is_summary(messages[0]):
+            messages.pop(0)
+        messages.insert(0, {"role": "system", "content": SYSTEM_PROMPT})
         # Add user prompt
         user_msg = {"role": "user", "content": prompt}
         messages.append(user_msg)
-        self.db.add_history(self.dirtree.cwd, json.dumps(user_msg))
+        turn = [user_msg]
         # Chat loop for tools
         while True:
-            tools = [self._format_tool(t) for t in self.tool_definitions]
-            response_data = self._call_ollama(messages, tools=tools)
+            tools = [self._format_tool(t) for t in self.tool_definitions] if self.settings.get("tools", True) else None
+            response_data = self._call_ollama(messages, tools=tools, stream=stream)
             message = response_data["message"]
             messages.append(message)
-            self.db.add_history(self.dirtree.cwd, json.dumps(message))
+            turn.append(message)
             if "tool_calls" in message:
                 if message.get("content"):
                     logger(f"Superfluous message content: {message['content']}")
-                tool_results = []
+                calls = []
                 for tool_call in message["tool_calls"]:
                     function_name = tool_call["function"]["name"]
                     function_args = tool_call["function"]["arguments"]
                     if isinstance(function_args, str):
                         function_args = json.loads(function_args)
-                    request = self.request_classes[function_name](**function_args)
-                    result = json.dumps(self.tools_map[function_name](self, request))
+                    calls.append((function_name, self._tool_request(function_name, function_args)))
+                tool_results = []
+                for tool_call, result in zip(message["tool_calls"], self._run_tools(calls)):
                     tool_msg = {
                         "role": "tool",
                         "content": result,
                         "tool_call_id": tool_call["id"]
                     }
                     tool_results.append(tool_msg)
-                for tool_msg in tool_results:
-                    messages.append(tool_msg)
-                    self.db.add_history(self.dirtree.cwd, json.dumps(tool_msg))
-            else:
+                messages.extend(tool_results)
+                turn.extend(tool_results)
+            self.save_turn(turn)
+            turn = []
+            if "tool_calls" not in message:
+                tokens = response_data.get("prompt_eval_count", 0) + response_data.get("eval_count", 0)
+                self.compact(tokens=tokens or None)
                 return message["content"]
 
+    def _summarize(self, messages):
+        response_data = self._call_ollama([{"role": "system", "content": COMPACT_PROMPT},
+                                           {"role": "user", "content": transcript(messages)}])
+        return response_data["message"]["content"]
+
     def _format_tool(self, tool_def):
         return {
             "type": "function",
@@ -1,42 +1,71 @@
 from xai_sdk import Client
-from xai_sdk.chat import tool_result, user, system
+from xai_sdk.chat import Chunk, Response, tool_result, user, system, assistant
+from xai_sdk.proto import chat_pb2
 import json
+import threading
+import grpc
 from ..assistant import Assistant, register
-from ..constants import SYSTEM_PROMPT
+from ..compact import transcript
+from ..constants import SYSTEM_PROMPT, COMPACT_PROMPT
+from ..hedge import on_cancel
 from ..logger import logger
 
+_clients = {}
+_clients_lock = threading.Lock()
+
+def _client(api_key):
+    with _clients_lock:
+        if api_key not in _clients:
+            _clients[api_key] = Client(api_key=api_key, timeout=3600)
+        return _clients[api_key]
+
+def _seed(history):
+    roles = {"system": system, "user": user, "assistant": assistant}
+    for message in history:
+        content = message.get("content") or ""
+        if message["role"] == "tool":
+            yield user(f"Tool result:\n{content}")
+            continue
+        calls = [f"Called {c['function']['name']} {json.dumps(c['function'].get('arguments'))}"
+                 for c in message.get("tool_calls", [])]
+        content = "\n".join(([content] if content else []) + calls)
+        if content and message["role"] in roles:
+            yield roles[message["role"]](content)
+
 class XAI(Assistant):
     def __init__(self, model, provider, settings, db, dirtree):
         super().__init__(model, provider, settings, db, dirtree)
         self.api_key = json.loads(settings)["api_key"]
-        self.client = Client(api_key=self.api_key, timeout=3600)
+        self.client = _client(self.api_key)
 
     def _call_tools(self, response):
         if response.tool_calls:
-            results = []
+            calls = []
             for tool_call in response.tool_calls:
                 function_name = tool_call.function.name
                 function_args = json.loads(tool_call.function.arguments)
-                request = self.request_classes[function_name](**function_args)
-                result = json.dumps(self.tools_map[function_name](self, request))
-                results.append(tool_result(result))
-            return results
+                calls.append((function_name, self._tool_request(function_name, function_args)))
+            return [tool_result(result) for result in self._run_tools(calls)]
         return None
 
-    def prompt(self, prompt):
-        self.db.add_history(self.dirtree.cwd, json.dumps({"role": "user", "content": prompt}))
-        response_id = self.db.get_response_id(self.dirtree.cwd)
-        response = self._chat(prompt, response_id, None)
+    def prompt(self, prompt, stream=False):
+        messages = [{"role": "user", "content": prompt}]
+        response = self._chat(prompt, self.get_response_id(), None, stream)
         tool_results = self._call_tools(response)
-        while tool_results:
-            if tool_results and response.content:
+        while True:
+            if not tool_results:
+                messages.append({"role": "assistant", "content": response.content})
+            self.save_turn(messages, response.id)
+            messages = []
+            if not tool_results:
+                self.compact(tokens=response.usage.prompt_tokens + response.usage.completion_tokens)
+                return response.content
+            if response.content:
                 logger(f"Superfluous message content: {response.content}")
-            response = self._chat(prompt, response.id, tool_results)
+            response = self._chat(prompt, response.id, tool_results, stream)
             tool_results = self._call_tools(response)
-        self.db.add_history(self.dirtree.cwd, json.dumps({"role": "assistant", "content": response.content}))
-        return response.content
 
-    def _chat(self, prompt, response_id, tool_results):
+    def _chain(self, prompt, response_id, tool_results, history):
         if response_id:
             chat = self.client.chat.create(
                 model=self.model,
@@ -53,13 +82,88 @@ class XAI(Assistant):
                 tool_choice="auto"
             )
             chat.append(system(SYSTEM_PROMPT))
+            for message in _seed(history):
+                chat.append(message)
         if tool_results:
             for tr in tool_results:
                 chat.append(tr)
         else:
             chat.append(user(prompt))
-        response = chat.sample()
-        self.db.set_response_id(self.dirtree.cwd, response.id)
+        return chat
+
+    def _cached_chat(self, chat, call):
+        return self._cached(chat.proto.SerializeToString(deterministic=True), call,
+                            lambda r: r.proto.SerializeToString(),
+                            lambda b: Response(chat_pb2.GetChatCompletionResponse.FromString(b), 0))
+
+    def _sample(self, prompt, response_id, tool_results, history):
+        self._remaining()
+        chat = self._chain(prompt, response_id, tool_results, history)
+        response, cached = self._cached_chat(chat, lambda: self._sample_chat(chat))
+        return chat, response, cached is not None
+
+    def _sample_chat(self, chat):
+        # Same request as chat.sample(), but as a future a lost hedge race can cancel, bounded by the deadline
+        future = chat._stub.GetCompletion.future(chat._make_request(1), timeout=self._remaining())
+        on_cancel(future.cancel)
+        return Response(future.result(), 0)
+
+    def _stream(self, prompt, response_id, tool_results, history):
+        self._remaining()
+        chat = self._chain(prompt, response_id, tool_results, history)
+        response, cached = self._cached_chat(chat, lambda: self._print_stream(chat))
+        if cached is not None and response.content:
+            print(response.content)
+        return chat, response, cached is not None
+
+    def _print_stream(self, chat):
+        # Same as chat.stream(), bounded by the deadline
+        response = Response(chat_pb2.GetChatCompletionResponse(choices=[chat_pb2.Choice()]), 0)
+        for proto in chat._stub.GetCompletionChunk(chat._make_request(1), timeout=self._remaining()):
+            response.process_chunk(proto)
+            chunk = Chunk(proto, 0)
+            if chunk.content:
+                print(chunk.content, end="", flush=True)
+            for choice in chunk.choices:
+                for tool_call in choice.tool_calls:
+                    logger(f"Calling {tool_call.function.name}")
+        if response.content:
+            print()
         return response
 
+    def _transient(self, e):
+        return isinstance(e, grpc.RpcError) and e.code() in (grpc.StatusCode.UNAVAILABLE,
+                                                             grpc.StatusCode.RESOURCE_EXHAUSTED,
+                                                             grpc.StatusCode.DEADLINE_EXCEEDED)
+
+    def _chat(self, prompt, response_id, tool_results, stream=False):
+        history = None if response_id else self.get_messages()
+        with self.telemetry.span("model", self.model, stream=stream) as record:
+            call = XAI._stream if stream else XAI._sample
+            chat, response, cached = self._call_model(lambda a: call(a, prompt, response_id, tool_results, history),
+                                                      record, stream)
+            if cached:
+                record["meta"]["cached"] = True
+            self._record(record, chat, response)
+        return response
+
+    def _record(self, record, chat, response):
+        record["bytes_out"] = sum(m.ByteSize() for m in chat.messages)
+        record["bytes_in"] = response.proto.ByteSize()
+        record["prompt_tokens"] = response.usage.prompt_tokens
+        record["completion_tokens"] = response.usage.completion_tokens
+
+    def _summarize(self, messages):
+        response_id = self.get_response_id()
+        if response_id:
+            chat = self.client.chat.create(model=self.model, previous_response_id=response_id, store_messages=False)
+        else:
+            chat = self.client.chat.create(model=self.model, store_messages=False)
+            chat.append(user(transcript(messages)))
+        chat.append(user(COMPACT_PROMPT))
+        with self.telemetry.span("model", self.model, summarize=True) as record:
+            response = self._cached_chat(chat, chat.sample)[0]
+            self._record(record, chat, response)
+        return response.content
+
 register("xai", XAI)
\ No newline at end of file
@@ -0,0 +1,86 @@
+import json
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from .constants import TRACE_ENV
+
+class Telemetry:
+    def __init__(self, db, context, model):
+        self.db = db
+        self.context = context
+        self.model = model
+        self.events = []
+        self.run = uuid.uuid4().hex
+
+    @contextmanager
+    def span(self, kind, name, **meta):
+        record = {"kind": kind, "name": name, "started": time.time(), "bytes_in": 0, "bytes_out": 0,
+                  "prompt_tokens": None, "completion_tokens": None, "meta": meta,
+                  "thread": threading.get_ident()}
+        start = time.perf_counter()
+        try:
+            yield record
+        finally:
+            record["duration"] = time.perf_counter() - start
+            self.events.append(record)
+
+    def flush(self):
+        events, self.events = self.events, []
+        if not events:
+            return
+        rows = [{"run": self.run, "context": self.context, "model": self.model,
+                 **{k: v for k, v in e.items() if k != "thread"}, "meta": json.dumps(e["meta"])} for e in events]
+        self.db.defer(lambda db: db.add_telemetry(rows))
+        trace = os.environ.get(TRACE_ENV)
+        if trace:
+            self._write_trace(trace, events)
+        self.run = uuid.uuid4().hex
+
+    def _write_trace(self, path, events):
+        trace = [{"name": e["name"], "cat": e["kind"], "ph": "X", "pid": os.getpid(), "tid": e["thread"],
+                  "ts": int(e["started"] * 1e6), "dur": int(e["duration"] * 1e6),
+                  "args": {"bytes_in": e["bytes_in"], "bytes_out": e["bytes_out"],
+                           "prompt_tokens": e["prompt_tokens"], "completion_tokens": e["completion_tokens"],
+                           **e["meta"]}}
+                 for e in events]
+        with open(path, "w") as file:
+            json.dump({"traceEvents": trace, "displayTimeUnit": "ms"}, file)
+
+def percentile(values, p):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    k = (len(values) - 1) * p / 100
+    lo = int(k)
+    hi = min(lo + 1, len(values) - 1)
+    return values[lo] + (values[hi] - values[lo]) * (k - lo)
+
+def summarize(rows):
+    groups = {}
+    for row in rows:
+        key = (row["kind"], row["context"] if row["kind"] == "model" else None,
+               row["model"] if row["kind"] == "model" else row["name"])
+        groups.setdefault(key, []).append(row)
+    summary = []
+    for (kind, context, name), group in sorted(groups.items(), key=lambda g: (g[0][0], g[0][1] or "", g[0][2])):
+        durations = [r["duration"] for r in group]
+        summary.append({"kind": kind, "context": context, "name": name, "calls": len(group),
+                        "p50": percentile(durations, 50), "p90": percentile(durations, 90),
+                        "p99": percentile(durations, 99), "max": max(durations),
+                        "bytes_in": sum(r["bytes_in"] or 0 for r in group),
+                        "bytes_out": sum(r["bytes_out"] or 0 for r in group),
+                        "prompt_tokens": sum(r["prompt_tokens"] or 0 for r in group),
+                        "completion_tokens": sum(r["completion_tokens"] or 0 for r in group)})
+    return summary
+
+def encoding_savings(rows):
+    totals = {"bytes": 0, "json_bytes": 0, "tokens": 0, "json_tokens": 0}
+    for row in rows:
+        meta = json.loads(row["meta"]) if row["kind"] == "tool" and row["meta"] else {}
+        if "json_bytes" in meta:
+            totals["bytes"] += row["bytes_out"] or 0
+            for key in ("json_bytes", "tokens", "json_tokens"):
+                totals[key] += meta[key]
+    return totals
@@ -0,0 +1,46 @@
+import json
+import os
+import pytest
+from tldc.assistant import Assistant, ReadFileRequest
+from tldc.db import DB
+from tldc.dirtree import DirTree
+
+class _Stub(Assistant):
+    def prompt(self, prompt, stream=False):
+        return prompt
+
+    def _summarize(self, messages):
+        return ""
+
+def test_provider_must_implement_summarize():
+    class Incomplete(Assistant):
+        def prompt(self, prompt, stream=False):
+            return prompt
+    db = DB()
+    with pytest.raises(TypeError, match="_summarize"):
+        Incomplete("m", "test", json.dumps({}), db, DirTree(os.getcwd(), db))
+    db.close()
+
+def test_invalid_tool_arguments_are_reported():
+    db = DB()
+    assistant = _Stub("m", "test", json.dumps({}), db, DirTree(os.getcwd(), db))
+    request = assistant._tool_request("read_file", {"path": "a.py", "offset": -1})
+    assert request.startswith("Trying to call read_file: invalid arguments, offset:")
+    assert isinstance(assistant._tool_request("read_file", {"path": "a.py", "offset": 0}), ReadFileRequest)
+    assert assistant._run_tools([("read_file", request)]) == [request]
+    db.close()
+
+def test_session_prune_reloads_history():
+    db = DB()
+    assistant = _Stub("m", "test", json.dumps({}), db, DirTree(os.getcwd(), db))
+    assistant.start_session()
+    for n in range(3):
+        assistant.save_turn([{"role": "user", "content": f"question {n}"},
+                             {"role": "assistant", "content": f"answer {n}"}], f"response {n}")
+    assistant.prune(None, 1)
+    assert assistant.get_messages() == [{"role": "user", "content": "question 2"},
+                                        {"role": "assistant", "content": "answer 2"}]
+    assert assistant.get_response_id() is None
+    assert [json.loads(m) for m in db.get_history(os.getcwd())] == assistant.get_messages()
+    db.stop_writer()
+    db.close()
@@ -0,0 +1,8 @@
+from click.testing import CliRunner
+from tldc.main import main
+
+def test_root_help():
+    for args in ([], ["--help"]):
+        result = CliRunner().invoke(main, args)
+        assert result.exit_code == 0, result.output
+        assert "batch MANIFEST RESULTS --workers WORKERS" in result.output
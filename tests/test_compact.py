@@ -0,0 +1,39 @@
+import json
+import os
+from tldc.assistant import Assistant
+from tldc.compact import SUMMARY_PREFIX, compact_messages, estimate_messages
+from tldc.db import DB
+from tldc.dirtree import DirTree
+
+def _turns(count):
+    messages = []
+    for n in range(count):
+        messages += [{"role": "user", "content": f"question {n}"}, {"role": "assistant", "content": f"answer {n}"}]
+    return messages
+
+class _Summarizing(Assistant):
+    def prompt(self, prompt, stream=False):
+        return prompt
+
+    def _summarize(self, messages):
+        return f"{len(messages)} messages"
+
+def test_reported_usage_over_budget():
+    messages = _turns(4)
+    budget = 1000
+    assert estimate_messages(messages) < budget
+    assert compact_messages(messages, budget, 2, lambda m: "x") == messages
+    compacted = compact_messages(messages, budget, 2, lambda m: "summary", tokens=budget + 1)
+    assert compacted[0] == {"role": "system", "content": SUMMARY_PREFIX + "summary"}
+    assert compacted[1:] == messages[4:]
+
+def test_assistant_compacts_on_reported_usage():
+    db = DB()
+    assistant = _Summarizing("m", "test", json.dumps({"compact_budget": 1000}), db, DirTree(os.getcwd(), db))
+    assistant.save_turn(_turns(4))
+    assert assistant.compact(tokens=500) is None
+    assert assistant.compact(tokens=5000) is not None
+    messages = assistant.get_messages()
+    assert messages[0]["content"] == SUMMARY_PREFIX + "4 messages"
+    assert len(messages) == 5
+    db.close()
@@ -0,0 +1,49 @@
+import sqlite3
+import pytest
+import tldc.db
+from tldc.db import DB
+
+def test_writer_retries_locked_database(monkeypatch):
+    monkeypatch.setattr(tldc.db, "DB_WRITE_BACKOFF", 0)
+    attempts = []
+
+    def job(db):
+        attempts.append(1)
+        if len(attempts) < 3:
+            raise sqlite3.OperationalError("database is locked")
+        db.set_config_value("key", "value")
+    db = DB()
+    db.start_writer()
+    db.defer(job)
+    db.stop_writer()
+    assert len(attempts) == 3
+    assert db.get_config_value("key") == "value"
+    db.close()
+
+def test_writer_surfaces_failures():
+    def job(db):
+        raise sqlite3.IntegrityError("constraint failed")
+    db = DB()
+    db.start_writer()
+    db.defer(job)
+    with pytest.raises(RuntimeError, match="constraint failed"):
+        db.stop_writer()
+    db.close()
+
+def test_failed_transaction_rolls_back():
+    db = DB()
+    with pytest.raises(ValueError):
+        with db.transaction():
+            db.set_config_value("key", "value")
+            raise ValueError
+    assert db.get_config_value("key") is None
+    db.close()
+
+def test_prune_code_drops_orphaned_rows():
+    db = DB()
+    for _ in range(3):
+        db.update_code("/w", {"a.py": "x = 1"}, [])
+    assert not db.prune_code(1)
+    assert db.prune_code(0)
+    assert db.get_code_paths("/w") == set()
+    db.close()
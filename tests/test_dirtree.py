@@ -0,0 +1,114 @@
+import os
+from tldc.db import DB
+import tldc.dirtree
+from tldc.dirtree import DirTree
+
+UNCHANGED = "a.py is unchanged since your last read in this conversation."
+
+def _dirtree():
+    db = DB()
+    return DirTree(os.getcwd(), db), db
+
+def test_exact_edit_is_remembered():
+    dirtree, db = _dirtree()
+    open("a.py", "w").write("def f():\n    return 1\n")
+    dirtree.read_file("a.py")
+    assert dirtree.write_file("a.py", "return 1", "return 2") == "OK, line 2"
+    assert dirtree.read_file("a.py") == UNCHANGED
+    db.close()
+
+def test_fuzzy_edit_is_not_remembered():
+    dirtree, db = _dirtree()
+    open("a.py", "w").write("class A:\n    def f(self):\n        return 1\n")
+    dirtree.read_file("a.py")
+    result = dirtree.write_file("a.py", "def f(self):\n    retrun 1", "def f(self):\n    return 2")
+    assert result.startswith("OK, lines 2-3, fuzzy match")
+    assert dirtree.read_file("a.py") == "class A:\n    def f(self):\n        return 2\n"
+    db.close()
+
+def test_crlf_edit_keeps_line_endings():
+    dirtree, db = _dirtree()
+    open("a.py", "w", newline="").write("one\r\ntwo\r\n")
+    dirtree.read_file("a.py")
+    assert dirtree.write_file("a.py", "two", "three") == "OK, line 2"
+    assert open("a.py", newline="").read() == "one\r\nthree\r\n"
+    assert dirtree.read_file("a.py") == UNCHANGED
+    db.close()
+
+def test_invalid_utf8_after_binary_check():
+    dirtree, db = _dirtree()
+    open("a.py", "wb").write(b"x = 1\n" * 2000 + b"y = '\xff'\n")
+    assert dirtree.read_file("a.py").endswith("y = '�'\n")
+    db.close()
+
+def test_long_line_truncation_notice():
+    dirtree, db = _dirtree()
+    open("a.js", "w").write("x" * 320 * 1024)
+    header = dirtree.read_file("a.js").split("\n", 1)[0]
+    assert header.startswith("a.js: lines 1-1 of 1, output capped at")
+    assert "use offset and length" in header
+    db.close()
+
+def test_unchanged_dirs_are_not_relisted():
+    dirtree, db = _dirtree()
+    os.makedirs("pkg/sub")
+    open("pkg/sub/a.py", "w").write("a = 1\n")
+    open("pkg/b.py", "w").write("b = 1\n")
+    for path in (".", "pkg", "pkg/sub"):
+        os.utime(path, (1, 1))
+    assert dirtree.update_index() == (["pkg/b.py", "pkg/sub/a.py"], [], [])
+    open("pkg/sub/hidden.py", "w").write("\n")
+    os.utime("pkg/sub", (1, 1))
+    open("pkg/sub/a.py", "w").write("a = 22\n")
+    assert dirtree.update_index() == ([], ["pkg/sub/a.py"], [])
+    open("pkg/c.py", "w").write("c = 1\n")
+    os.remove("pkg/b.py")
+    assert dirtree.update_index() == (["pkg/c.py"], [], ["pkg/b.py"])
+    open(".gitignore", "w").write("sub/\n")
+    assert dirtree.update_index() == ([".gitignore"], [], ["pkg/sub/a.py"])
+    db.close()
+
+def test_search_reads_contents_from_disk():
+    dirtree, db = _dirtree()
+    open("a.py", "w").write("def needle():\n    pass\n")
+    open("b.py", "w").write("x = 1\n")
+    dirtree.update_index()
+    assert db.connection.execute("SELECT COUNT(*) FROM code WHERE content IS NOT NULL").fetchone()[0] == 0
+    assert dirtree.search_code("needle", False, None, False) == "1 matches in 1 files\na.py:1: def needle():"
+    open("a.py", "w").write("def other():\n    pass\n")
+    dirtree.update_index()
+    assert dirtree.search_code("needle", False, None, False) == "No matches for needle"
+    assert dirtree.search_code("x", False, None, False) == "1 matches in 1 files\nb.py:1: x = 1"
+    db.close()
+
+def test_search_glob_applies_before_file_limit(monkeypatch):
+    monkeypatch.setattr(tldc.dirtree, "SEARCH_MAX_FILES", 5)
+    dirtree, db = _dirtree()
+    for n in range(10):
+        open(f"{n}.md", "w").write("needle needle needle\n")
+    open("a.py", "w").write("# needle\n")
+    dirtree.update_index()
+    assert dirtree.search_code("needle", False, "*.py", False) == "1 matches in 1 files\na.py:1: # needle"
+    assert db.search_code(dirtree.cwd, "x", 5) == ["0.md", "1.md", "2.md", "3.md", "4.md"]
+    db.close()
+
+def test_read_files_reads_each_path_once():
+    dirtree, db = _dirtree()
+    open("a.txt", "w").write("hello\n")
+    assert dirtree.read_files(["a.txt", "./a.txt", "a.txt", "sub/../a.txt"]) == {"a.txt": "hello\n"}
+    db.close()
+
+def test_save_respects_umask_and_existing_mode():
+    dirtree, db = _dirtree()
+    umask = os.umask(0o027)
+    try:
+        dirtree.write_file("new.py", "", "x = 1\n")
+        open("old.py", "w").write("x = 1\n")
+        os.chmod("old.py", 0o755)
+        dirtree.write_file("old.py", "x = 1", "x = 2")
+    finally:
+        os.umask(umask)
+    assert os.stat("new.py").st_mode & 0o777 == 0o640
+    assert os.stat("old.py").st_mode & 0o777 == 0o755
+    assert sorted(os.listdir(".")) == ["new.py", "old.py"]
+    db.close()
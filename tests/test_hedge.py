@@ -0,0 +1,71 @@
+import json
+import os
+import select
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from tldc.db import DB
+from tldc.dirtree import DirTree
+from tldc.hedge import on_cancel, race
+from tldc.providers.ollama import Ollama
+
+def test_race_cancels_loser():
+    cancelled = threading.Event()
+
+    def slow():
+        on_cancel(cancelled.set)
+        cancelled.wait(5)
+        raise RuntimeError("cancelled")
+    assert race([slow, lambda: "fast"], 0.05)[:2] == (1, "fast")
+    assert cancelled.wait(1)
+
+def test_hedge_delay_follows_latency():
+    db = DB()
+    settings = json.dumps({"url": "http://127.0.0.1:1", "hedge": {"model": "fast", "min_delay": 0}})
+    ollama = Ollama("slow", "ollama", settings, db, DirTree(os.getcwd(), db))
+
+    def add(duration, count):
+        db.add_telemetry([{"run": "r", "context": "/w", "model": "slow", "kind": "model", "name": "slow",
+                           "started": time.time() + n / 1000, "duration": duration, "bytes_in": 0, "bytes_out": 0,
+                           "prompt_tokens": 0, "completion_tokens": 0, "meta": "{}"} for n in range(count)])
+    add(1.0, 20)
+    assert ollama._hedge_delay() == 1.0
+    time.sleep(0.05)
+    add(3.0, 200)
+    assert ollama._hedge_delay() == 3.0
+    db.close()
+
+def test_lost_ollama_request_is_disconnected():
+    disconnected = threading.Event()
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, *args):
+            pass
+
+        def do_POST(self):
+            body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+            if body["model"] == "slow":
+                if select.select([self.connection], [], [], 5)[0] and not self.connection.recv(1):
+                    disconnected.set()
+                return
+            data = json.dumps({"message": {"role": "assistant", "content": "fast"}, "done": True}).encode()
+            self.send_response(200)
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_port}"
+    db = DB()
+    db.add_model("fast", "ollama", json.dumps({"url": url}))
+    settings = json.dumps({"url": url, "tools": False, "hedge": {"model": "fast", "delay": 0.1}})
+    ollama = Ollama("slow", "ollama", settings, db, DirTree(os.getcwd(), db))
+    started = time.monotonic()
+    assert ollama.prompt("hello") == "fast"
+    assert time.monotonic() - started < 2
+    assert disconnected.wait(2)
+    server.shutdown()
+    db.close()
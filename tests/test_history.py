@@ -0,0 +1,52 @@
+import json
+import time
+import zlib
+from tldc.constants import HISTORY_ZDICTS
+from tldc.db import DB, pack_message, unpack_message
+
+def _add_turns(db, context, count, created):
+    for n in range(count):
+        for message in ({"role": "user", "content": f"question {n}"}, {"role": "assistant", "content": f"answer {n}"}):
+            db.add_history(context, json.dumps(message))
+    db.connection.execute("UPDATE history SET created = :created", {"created": created})
+    db.commit()
+
+def test_history_roundtrip_compressed():
+    db = DB()
+    message = json.dumps({"role": "tool", "content": "x" * 2000})
+    db.add_history("/w", message)
+    assert db.get_history("/w") == [message]
+    row = db.get_history_stats("/w").fetchone()
+    assert row["size"] == len(message) and row["stored"] < row["size"]
+    db.close()
+
+def test_history_decodes_older_dictionaries():
+    message = json.dumps({"role": "user", "content": "hello " * 100})
+    for version, zdict in enumerate(HISTORY_ZDICTS, 1):
+        compressor = zlib.compressobj(zdict=zdict)
+        assert unpack_message(bytes([version]) + compressor.compress(message.encode()) + compressor.flush()) == message
+    assert pack_message(message)[0] == len(HISTORY_ZDICTS)
+
+def test_prune_by_age_keeps_latest_turn():
+    db = DB()
+    _add_turns(db, "/w", 3, time.time() - 10 * 86400)
+    assert db.prune_history("/w", max_age=1) == 4
+    assert [json.loads(m)["content"] for m in db.get_history("/w")] == ["question 2", "answer 2"]
+    db.close()
+
+def test_prune_by_size_keeps_latest_turn():
+    db = DB()
+    _add_turns(db, "/w", 3, time.time())
+    assert db.prune_history("/w", max_bytes=1) == 4
+    assert len(db.get_history("/w")) == 2
+    db.close()
+
+def test_prune_clears_reads():
+    db = DB()
+    _add_turns(db, "/w", 2, time.time() - 10 * 86400)
+    db.set_read("/w", "a.py", 1, 1, "hash", "a")
+    db.set_response_id("/w", "response")
+    db.prune_history("/w", max_age=1)
+    assert db.get_read("/w", "a.py") is None
+    assert db.get_response_id("/w") is None
+    db.close()
@@ -0,0 +1,54 @@
+import os
+import pytest
+from tldc.ignore import IgnoreMatcher
+
+CASES = [
+    ({".gitignore": "*.log\n!keep.log\n"}, "a.log", False, True),
+    ({".gitignore": "*.log\n!keep.log\n"}, "sub/keep.log", False, False),
+    ({".gitignore": "/build\n"}, "build", True, True),
+    ({".gitignore": "/build\n"}, "src/build", True, False),
+    ({".gitignore": "build\n"}, "src/build", True, True),
+    ({".gitignore": "doc/frotz\n"}, "doc/frotz", False, True),
+    ({".gitignore": "doc/frotz\n"}, "a/doc/frotz", False, False),
+    ({".gitignore": "**/foo\n"}, "x/y/foo", False, True),
+    ({".gitignore": "a/**/b\n"}, "a/b", False, True),
+    ({".gitignore": "a/**/b\n"}, "a/x/y/b", False, True),
+    ({".gitignore": "a/**/b\n"}, "x/a/b", False, False),
+    ({".gitignore": "logs/**\n"}, "logs/x/y.txt", False, True),
+    ({".gitignore": "out/\n"}, "out", True, True),
+    ({".gitignore": "out/\n"}, "out", False, False),
+    ({".gitignore": "out/\n"}, "out/a.py", False, True),
+    ({".gitignore": "dir/\n!dir/a.py\n"}, "dir/a.py", False, True),
+    ({".gitignore": "*.tmp\n"}, "sub/x.tmp", False, True),
+    ({".gitignore": "*.tmp\n", "sub/.gitignore": "!x.tmp\n"}, "sub/x.tmp", False, False),
+    ({".gitignore": "*.tmp\n", "sub/.gitignore": "!x.tmp\n"}, "x.tmp", False, True),
+    ({"sub/.gitignore": "/a.py\n"}, "sub/a.py", False, True),
+    ({"sub/.gitignore": "/a.py\n"}, "a.py", False, False),
+    ({".gitignore": "\\*lit\n"}, "*lit", False, True),
+    ({".gitignore": "\\*lit\n"}, "alit", False, False),
+    ({".gitignore": "\\#hash\n"}, "#hash", False, True),
+    ({".gitignore": "# comment\n"}, "# comment", False, False),
+    ({".gitignore": "\\!bang\n"}, "!bang", False, True),
+    ({".gitignore": "file?.[ch]\n"}, "file1.c", False, True),
+    ({".gitignore": "file?.[!ch]\n"}, "file1.c", False, False),
+    ({".tldcignore": "*.py\n"}, "a.py", False, True),
+    ({".gitignore": "*.py\n", ".tldcignore": "!a.py\n"}, "a.py", False, False),
+    ({}, "pkg/__pycache__", True, True),
+]
+
+@pytest.mark.parametrize("files,rel,is_dir,ignored", CASES)
+def test_rules(files, rel, is_dir, ignored):
+    for path, content in files.items():
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        open(path, "w").write(content)
+    assert IgnoreMatcher(os.getcwd()).is_ignored(rel, is_dir) is ignored
+
+def test_rules_from_repository_root():
+    os.makedirs(".git/info")
+    os.makedirs("sub")
+    open(".git/info/exclude", "w").write("*.bak\n")
+    open(".gitignore", "w").write("/sub/gen.py\n")
+    matcher = IgnoreMatcher(os.path.abspath("sub"))
+    assert matcher.is_ignored("gen.py", False)
+    assert matcher.is_ignored("a.bak", False)
+    assert not matcher.is_ignored("other/gen.py", False)
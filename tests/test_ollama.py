@@ -0,0 +1,117 @@
+import json
+import os
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import pytest
+import requests
+from tldc.compact import SUMMARY_PREFIX
+from tldc.constants import SYSTEM_PROMPT
+from tldc.db import DB
+from tldc.dirtree import DirTree
+from tldc.providers.ollama import Ollama
+
+def _server(error, script=None, stall=None):
+    requests_seen = []
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, *args):
+            pass
+
+        def do_POST(self):
+            body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+            requests_seen.append(body)
+            if stall == "body":
+                self.send_response(200)
+                self.send_header("Content-Length", "1000")
+                self.end_headers()
+                self.wfile.write(b'{"message": ')
+                self.wfile.flush()
+            if stall:
+                threading.Event().wait(2)
+                return
+            if script:
+                data, status = json.dumps({"message": script.pop(0), "done": True}).encode(), 200
+            elif body.get("tools"):
+                data, status = json.dumps({"error": error}).encode(), 400
+            else:
+                data, status = json.dumps({"message": {"role": "assistant", "content": "hi"}, "done": True}).encode(), 200
+            self.send_response(status)
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, requests_seen
+
+def _ollama(server, db, **extra):
+    settings = json.dumps({"url": f"http://127.0.0.1:{server.server_port}", "retries": 0, **extra})
+    db.add_model("stub", "ollama", settings)
+    return Ollama("stub", "ollama", settings, db, DirTree(os.getcwd(), db))
+
+def test_tools_unsupported_falls_back():
+    server, seen = _server("registry.ollama.ai/library/gemma:2b does not support tools")
+    db = DB()
+    ollama = _ollama(server, db)
+    assert ollama.prompt("hello") == "hi"
+    assert "tools" in seen[0] and "tools" not in seen[1]
+    assert json.loads(db.get_model("stub")["settings"])["tools"] is False
+    server.shutdown()
+    db.close()
+
+def test_other_bad_request_keeps_tools():
+    server, seen = _server("invalid message format")
+    db = DB()
+    ollama = _ollama(server, db)
+    with pytest.raises(requests.HTTPError):
+        ollama.prompt("hello")
+    assert all("tools" in body for body in seen)
+    assert "tools" not in json.loads(db.get_model("stub")["settings"])
+    server.shutdown()
+    db.close()
+
+def test_generation_posts_are_not_retried_on_read_timeout():
+    server, _ = _server("")
+    db = DB()
+    retry = _ollama(server, db).session.get_adapter(f"http://127.0.0.1:{server.server_port}").max_retries
+    assert retry.read == 0 and retry.connect == retry.status
+    server.shutdown()
+    db.close()
+
+def test_tool_calls():
+    open("a.py", "w").write("x = 1\n")
+    calls = [{"id": "1", "function": {"name": "read_file", "arguments": {"path": "a.py"}}},
+             {"id": "2", "function": {"name": "read_file", "arguments": {"path": "a.py", "offset": -1}}}]
+    server, seen = _server("", [{"role": "assistant", "content": "", "tool_calls": calls},
+                                {"role": "assistant", "content": "done"}])
+    db = DB()
+    assert _ollama(server, db).prompt("read it") == "done"
+    results = [m["content"] for m in seen[1]["messages"] if m["role"] == "tool"]
+    assert results[0] == "x = 1\n"
+    assert results[1].startswith("Trying to call read_file: invalid arguments")
+    server.shutdown()
+    db.close()
+
+def test_single_system_prompt():
+    server, seen = _server("", [{"role": "assistant", "content": "done"}])
+    db = DB()
+    ollama = _ollama(server, db)
+    summary = {"role": "system", "content": SUMMARY_PREFIX + "earlier"}
+    ollama.save_turn([{"role": "system", "content": "old system prompt"}, summary])
+    ollama.prompt("hello")
+    assert seen[0]["messages"][:2] == [{"role": "system", "content": SYSTEM_PROMPT}, summary]
+    server.shutdown()
+    db.close()
+
+@pytest.mark.parametrize("stall,stream", [("headers", False), ("body", True)])
+def test_read_timeout_is_not_retried(stall, stream):
+    server, seen = _server("", stall=stall)
+    db = DB()
+    ollama = _ollama(server, db, timeout=0.3, model_retries=2, model_backoff=0, tools=False)
+    with pytest.raises(requests.ConnectionError):
+        ollama.prompt("hello", stream)
+    assert len(seen) == 1
+    server.shutdown()
+    db.close()
@@ -0,0 +1,45 @@
+import json
+import os
+import time
+from concurrent.futures import Future
+from xai_sdk.proto import chat_pb2
+from tldc.db import DB
+from tldc.dirtree import DirTree
+from tldc.providers.xai import XAI
+
+def test_chain_from_ollama_history():
+    db = DB()
+    xai = XAI("grok", "xai", json.dumps({"api_key": "test"}), db, DirTree(os.getcwd(), db))
+    history = [{"role": "user", "content": "list files"},
+               {"role": "assistant", "content": "",
+                "tool_calls": [{"function": {"name": "list_current_dir", "arguments": {}}}]},
+               {"role": "tool", "content": "a.py", "tool_name": "list_current_dir"},
+               {"role": "assistant", "content": "There is a.py"}]
+    chat = xai._chain("next", None, None, history)
+    texts = [m.content[0].text for m in chat.messages]
+    assert texts[1:] == ["list files", "Called list_current_dir {}", "Tool result:\na.py", "There is a.py", "next"]
+    assert not any(m.tool_calls for m in chat.messages)
+    db.close()
+
+def test_calls_are_bounded_by_the_deadline():
+    db = DB()
+    xai = XAI("grok", "xai", json.dumps({"api_key": "test"}), db, DirTree(os.getcwd(), db))
+    xai.deadline = time.monotonic() + 30
+    chat = xai._chain("hi", None, None, [])
+    timeouts = []
+
+    def future(request, timeout=None):
+        timeouts.append(timeout)
+        result = Future()
+        result.set_result(chat_pb2.GetChatCompletionResponse(choices=[chat_pb2.Choice()]))
+        return result
+
+    def chunks(request, timeout=None):
+        timeouts.append(timeout)
+        return iter([])
+    chat._stub = type("Stub", (), {"GetCompletion": type("Call", (), {"future": staticmethod(future)}),
+                                   "GetCompletionChunk": staticmethod(chunks)})
+    xai._sample_chat(chat)
+    xai._print_stream(chat)
+    assert len(timeouts) == 2 and all(0 < t <= 30 for t in timeouts)
+    db.close()